@@ -0,0 +1,296 @@
+"""Headless performance benchmark for the image screensaver
+
+Generates a synthetic image tree, then measures folder scanning, the phases
+of loading one slide, update_image latency, the memory high-water mark and
+slide interval jitter against the 1500 ms target. Results are written as
+JSON so runs of different versions can be compared.
+
+The slideshow part needs a display; on a Linux box without one use a
+virtual X server:
+
+    xvfb-run -s "-screen 0 1920x1080x24" python benchmark.py --images 200
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+# Keep the index, caches and quarantine of the benchmark away from the real ones
+WORK_DIR = tempfile.mkdtemp(prefix="screensaver-bench-")
+os.environ["HOME"] = os.environ["USERPROFILE"] = WORK_DIR
+
+from PIL import Image, ImageTk
+
+import main
+from main import SLIDE_INTERVAL_MS
+
+ORIENTATIONS = (3, 6, 8)
+
+def summarize(values):
+    """Mean, percentiles and max of a list of numbers"""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+    return {"count": len(values), "mean": statistics.fmean(values),
+            "p50": pct(50), "p95": pct(95), "max": ordered[-1]}
+
+def max_rss_mb():
+    """Peak resident set size of this process"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+def rss_mb():
+    """Current resident set size of this process, or None where it cannot be read"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+def generate_tree(folder, count, formats, sizes, orientation_ratio, per_folder, seed):
+    """Write count synthetic images spread over nested folders"""
+    rng = random.Random(seed)
+    base = {}
+    for i in range(count):
+        fmt = formats[i % len(formats)]
+        size = sizes[i % len(sizes)]
+        if size not in base:
+            # Noise over a gradient compresses about as badly as a photo
+            noise = Image.effect_noise(size, 40).convert("RGB")
+            gradient = Image.linear_gradient("L").resize(size).convert("RGB")
+            base[size] = Image.blend(noise, gradient, 0.5)
+
+        sub = os.path.join(folder, f"d{i // per_folder // 10}", f"e{i // per_folder}")
+        os.makedirs(sub, exist_ok=True)
+        path = os.path.join(sub, f"img{i:06d}.{fmt}")
+        exif = Image.Exif()
+        if rng.random() < orientation_ratio:
+            exif[274] = rng.choice(ORIENTATIONS)
+        img = base[size]
+        if fmt == "gif":
+            img.convert("P").save(path)
+        elif fmt == "tif16":
+            # 16-bit big-endian grayscale, as scanners write it
+            img.convert("L").convert("I;16B").save(path[:-len(fmt)] + "tif", exif=exif)
+        elif fmt in ("jpg", "webp"):
+            img.save(path, quality=90, exif=exif)
+        else:
+            img.save(path, exif=exif)
+
+def bench_scan(folder):
+    """Time get_image_files with an empty and with a warm file index"""
+    results = {}
+    for label, rebuild in (("cold", True), ("warm", False)):
+        scanner = main.ImageViewer.__new__(main.ImageViewer)
+        scanner.rebuild_index = rebuild
+        start = time.perf_counter()
+        files = scanner.get_image_files([folder])
+        results[label + "_s"] = time.perf_counter() - start
+        results["files"] = len(files)
+    return results, files
+
+def bench_phases(files, root, screen_w, screen_h, samples):
+    """Time each phase of loading a slide, including the viewer's compose/paste path and drawing"""
+    phases = {}
+    canvas = main.Canvas(root, width=screen_w, height=screen_h)
+    canvas.pack()
+    # The state ImageViewer.compose works on: one persistent photo and canvas item, two screen buffers
+    screen = SimpleNamespace(screen_w=screen_w, screen_h=screen_h, buffer_boxes=[None, None],
+                             screen_buffers=[Image.new("RGB", (screen_w, screen_h)) for _ in range(2)])
+    photo = ImageTk.PhotoImage("RGB", (screen_w, screen_h))
+    canvas.create_image(screen_w // 2, screen_h // 2, image=photo, anchor="center")
+    front = 0
+    for path in files[:samples]:
+        timings = {}
+        start = time.perf_counter()
+        img = main.load_scaled_image(path, screen_w, screen_h, timings=timings)
+        t = time.perf_counter()
+        front = 1 - front
+        main.ImageViewer.compose(screen, front, img)
+        photo.paste(screen.screen_buffers[front])
+        timings["photoimage"] = time.perf_counter() - t
+        t = time.perf_counter()
+        root.update_idletasks()
+        timings["draw"] = time.perf_counter() - t
+        timings["total"] = time.perf_counter() - start
+        for phase, seconds in timings.items():
+            phases.setdefault(phase, []).append(seconds * 1000)
+    canvas.destroy()
+    return {phase: summarize(values) for phase, values in phases.items()}
+
+class BenchmarkViewer(main.ImageViewer):
+    """ImageViewer that records how long update_image takes and when slides change"""
+    duration = 30
+    rss_interval = None  # Seconds between RSS samples, for soak runs
+
+    def update_image(self, manual=False):
+        if not hasattr(self, "bench_calls"):
+            self.bench_calls = []
+            self.bench_shown = []
+            self.bench_rss = []
+            self.root.after(int(self.duration * 1000), self.close)
+            if self.rss_interval:
+                self.sample_rss()
+        shown_before = self.slides_shown
+        start = time.perf_counter()
+        super().update_image(manual)
+        end = time.perf_counter()
+        # Soak runs keep no per-slide lists, so they measure the viewer's memory alone
+        if self.slides_shown != shown_before and not self.rss_interval:
+            self.bench_calls.append((end - start) * 1000)
+            self.bench_shown.append(end)
+
+    def sample_rss(self):
+        self.bench_rss.append((time.perf_counter(), self.slides_shown, rss_mb()))
+        self.root.after(int(self.rss_interval * 1000), self.sample_rss)
+
+def bench_slideshow(folder, duration, decode_processes=0):
+    """Run the real slideshow and measure update_image latency and slide intervals"""
+    BenchmarkViewer.duration = duration
+    viewer = BenchmarkViewer([folder], decode_processes=decode_processes)
+    shown = getattr(viewer, "bench_shown", [])
+    intervals = [(b - a) * 1000 for a, b in zip(shown, shown[1:])]
+    jitter = [abs(interval - SLIDE_INTERVAL_MS) for interval in intervals]
+    return {
+        "time_to_first_image_ms": (viewer.time_to_first_image or 0) * 1000,
+        "slides": len(shown),
+        "update_image_ms": summarize(getattr(viewer, "bench_calls", [])),
+        "interval_ms": summarize(intervals),
+        "jitter_ms": summarize(jitter),
+        "peak_decode_mb": viewer.peak_decode_bytes / (1024 * 1024),
+    }
+
+def bench_soak(folder, hours, sample_s):
+    """Run the slideshow for hours and check that resident memory stays flat
+    
+    The first tenth of the run is warm-up, while caches fill. Growth is the
+    RSS at the end minus the RSS after warm-up.
+    """
+    BenchmarkViewer.duration = hours * 3600
+    BenchmarkViewer.rss_interval = sample_s
+    viewer = BenchmarkViewer([folder])
+    samples = [s for s in getattr(viewer, "bench_rss", []) if s[2] is not None]
+    if not samples:
+        return {"samples": 0}
+    start = samples[0][0]
+    warm = [s for s in samples if s[0] - start >= BenchmarkViewer.duration / 10] or samples
+    return {
+        "hours": hours,
+        "slides": viewer.slides_shown,
+        "samples": len(samples),
+        "rss_start_mb": samples[0][2],
+        "rss_after_warmup_mb": warm[0][2],
+        "rss_end_mb": samples[-1][2],
+        "rss_max_mb": max(s[2] for s in samples),
+        "growth_after_warmup_mb": samples[-1][2] - warm[0][2],
+        "rss_mb": [[round(t - start), shown, round(rss, 1)] for t, shown, rss in samples],
+    }
+
+def git_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+def parse_size(text):
+    w, h = text.lower().split("x")
+    return int(w), int(h)
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=100, help="number of synthetic images")
+    parser.add_argument("--formats", default="jpg,png,webp,tif,tif16", help="comma-separated file extensions, tif16 for 16-bit grayscale TIFF")
+    parser.add_argument("--sizes", default="4000x3000,6000x4000,1920x1080",
+                        help="comma-separated source resolutions, used round-robin")
+    parser.add_argument("--orientation-ratio", type=float, default=0.3,
+                        help="fraction of images with a rotating EXIF orientation")
+    parser.add_argument("--per-folder", type=int, default=20, help="images per generated folder")
+    parser.add_argument("--samples", type=int, default=20, help="images timed phase by phase")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of slideshow to measure")
+    parser.add_argument("--decode-processes", type=int, default=0,
+                        help="decode slides in this many worker processes (0 decodes in-process)")
+    parser.add_argument("--soak", type=float, metavar="HOURS",
+                        help="only run the slideshow for this many hours, sampling resident memory")
+    parser.add_argument("--soak-sample", type=float, default=60, help="seconds between memory samples")
+    parser.add_argument("--tree", help="use an existing image folder instead of generating one")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    try:
+        folder = args.tree
+        generate_s = None
+        if not folder:
+            folder = os.path.join(WORK_DIR, "images")
+            start = time.perf_counter()
+            generate_tree(folder, args.images, args.formats.split(","),
+                          [parse_size(size) for size in args.sizes.split(",")],
+                          args.orientation_ratio, args.per_folder, args.seed)
+            generate_s = time.perf_counter() - start
+
+        if args.soak:
+            results = {
+                "version": git_version(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "platform": platform.platform(),
+                "args": vars(args),
+                "soak": bench_soak(folder, args.soak, args.soak_sample),
+            }
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+            print(json.dumps({k: v for k, v in results["soak"].items() if k != "rss_mb"}, indent=2))
+            return
+        
+        scan, files = bench_scan(folder)
+
+        root = main.Tk()
+        screen_w, screen_h = root.winfo_screenwidth(), root.winfo_screenheight()
+        phases = bench_phases(files, root, screen_w, screen_h, args.samples)
+        root.destroy()
+
+        slideshow = bench_slideshow(folder, args.duration, args.decode_processes)
+
+        results = {
+            "version": git_version(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "pillow": Image.__version__,
+            "platform": platform.platform(),
+            "screen": [screen_w, screen_h],
+            "args": vars(args),
+            "generate_s": generate_s,
+            "scan": scan,
+            "phases_ms": phases,
+            "slideshow": slideshow,
+            "max_rss_mb": max_rss_mb(),
+        }
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(json.dumps(results, indent=2))
+    finally:
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+if __name__ == "__main__":
+    main.freeze_support()
+    main_benchmark()
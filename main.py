@@ -1,11 +1,1972 @@
+import bz2
+import ctypes
+import ctypes.util
+import hashlib
+import io
+import json
+import lzma
 import os
+import queue
 import random
+import select
+import struct
 import sys
+import tarfile
+import threading
+import time
+import zipfile
+import zlib
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import (FIRST_COMPLETED, CancelledError, Future, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import freeze_support, shared_memory
+from types import SimpleNamespace
 from tkinter import Tk, Canvas, filedialog, messagebox, Toplevel, Label, Button, Frame, Listbox
-from PIL import Image, ImageTk
+from PIL import Image, ImageTk, UnidentifiedImageError
+
+# Number of upcoming slides decoded ahead of time by the worker pool
+PREFETCH_DEPTH = 3
+# Number of background threads used for decoding and scaling
+DECODE_WORKERS = 2
+# Decode in this many worker processes instead of in the threads above (0 decodes in-process)
+DECODE_PROCESSES = 0
+# Memory budget for recently shown and prefetched screen-sized frames
+FRAME_CACHE_BYTES = 256 * 1024 * 1024
+# Largest decoded source image accepted, in bytes; bigger files are skipped
+MAX_DECODE_BYTES = 512 * 1024 * 1024
+# Integer reductions stop once the image is this many times the screen size
+REDUCE_GAP = 2
+# Size limit of the on-disk cache of screen-sized renders, in bytes
+DISK_CACHE_BYTES = 1024 * 1024 * 1024
+# Number of folders listed concurrently while scanning, across all roots
+SCAN_WORKERS = 8
+# How often the UI picks up images found by the background discovery (ms)
+DISCOVERY_POLL_MS = 50
+# Pick up images added to or removed from the folders while the slideshow runs
+WATCH_FOLDERS = True
+# Changes are applied once the folders have been quiet for this long (seconds)...
+WATCH_DEBOUNCE = 2.0
+# ...or at the latest this long after the first one, during a long copy
+WATCH_MAX_DELAY = 30.0
+# Folder mtimes are checked this often when inotify is not available (seconds)
+WATCH_POLL_INTERVAL = 60.0
+# How often the UI picks up changes reported by the folder watcher (ms)
+WATCH_DRAIN_MS = 500
+# Positions that may be reordered by insertions before the playlist order is rebuilt
+PLAYLIST_MAX_OVERRIDES = 4096
+# The file index is saved after this many header probes
+PROBE_SAVE_EVERY = 2000
+# Bytes of an archive member read to probe its header, enough for the EXIF block of a JPEG
+PROBE_HEADER_BYTES = 256 * 1024
+# A quarantined image is retried after it changes, but only this many times in total
+QUARANTINE_MAX_ATTEMPTS = 3
+# Time each slide stays on screen (ms)
+SLIDE_INTERVAL_MS = 1500
+# The slideshow resumes this long after manual navigation (ms)
+RESUME_DELAY_MS = 2500
+# Wait after an image chosen by hand failed to load (ms)
+MANUAL_ERROR_DELAY_MS = 5000
+# A deleted image's file is removed this long after Delete, unless Ctrl+Z takes it back first (ms)
+DELETE_UNDO_MS = 5000
+# How often the UI checks for files the background deletion could not remove (ms)
+DELETE_POLL_MS = 250
+# The next frame is converted for display this long before it is due (ms)
+PREPARE_LEAD_MS = 250
+# A slide shown later than this after its deadline counts as a missed deadline (ms)
+DEADLINE_TOLERANCE_MS = 20
+# Longest wait after a run of images that failed to load (ms)
+ERROR_BACKOFF_MAX_MS = 5000
+# Collect per-phase timings of every slide (also enabled by --stats)
+STATS_ENABLED = False
+# Number of recent samples per phase the percentiles are computed from
+STATS_WINDOW = 500
+# How often the timings are written to the stats file (ms)
+STATS_EXPORT_MS = 60000
+# Formats that can be animated (GIF, WebP, APNG)
+ANIMATED_EXTS = {'.gif', '.webp', '.png'}
+# Memory budget for the scaled frames of the animation on screen; longer ones are decoded again every loop
+ANIMATION_CACHE_BYTES = 128 * 1024 * 1024
+# Frames with no delay or a tiny one are shown this long (ms), as browsers do
+ANIMATION_DEFAULT_FRAME_MS = 100
+# Upcoming slides remembered at exit, so the next start can show them before the folders are scanned
+SNAPSHOT_SLIDES = 8
+# How many of those have their scaled frame kept in the render cache for the next start
+SNAPSHOT_FRAMES = 3
+# How often the UI checks whether a frame that is still decoding is ready (ms)
+FRAME_POLL_MS = 20
+# Show a quick low-quality preview when a frame is not decoded in time, refined in place later
+PROGRESSIVE_RENDER = True
+# Previews are decoded at about 1/PREVIEW_SCALE of the screen size, then scaled up bilinearly
+PREVIEW_SCALE = 4
+# Formats whose decoder can scale down while decoding (JPEG DCT scaling)
+DRAFT_FORMATS = ("JPEG", "MPO")
+
+SUPPORTED_EXTS = {'.png', '.jpg', '.jpeg', '.jpe', '.bmp', '.gif', '.tiff', '.tif', '.webp', '.heic'}
+# Archives that can be configured as image sources (TAR only uncompressed, so members can be read by offset)
+ARCHIVE_EXTS = ('.zip', '.tar')
+# Archives kept open at once for reading members
+ARCHIVE_HANDLES = 8
+# Compressed bytes of an archive member read at once when it is decompressed in pieces
+ARCHIVE_CHUNK_BYTES = 1024 * 1024
+# Reader threads per configured root, so a stalled network share holds up only its own files
+READ_WORKERS_PER_ROOT = 2
+# Memory for file contents read but not yet decoded
+READ_AHEAD_BYTES = 256 * 1024 * 1024
+# Give up on a file read or stat after this many seconds
+READ_TIMEOUT = 5.0
+# Reads taking longer than this count as stalls (ms)
+READ_STALL_MS = 1000
+# A root whose read timed out is passed over for this many seconds while other roots have images
+SLOW_ROOT_PENALTY = 120.0
+# How far ahead the slideshow looks for an image from a healthy root
+SLOW_ROOT_SKIP = 32
+# Renders queued per export worker process, so a huge library is not submitted all at once
+EXPORT_QUEUE_PER_WORKER = 4
+# How often the export prints its progress (seconds)
+EXPORT_PROGRESS_INTERVAL = 5.0
+
+def app_file(suffix):
+    """Path of a per-user file or folder kept next to the configuration"""
+    return os.path.join(os.path.expanduser("~"), "ImageViewerScreensaver" + suffix)
+
+ORIENTATION_TRANSFORMS = {
+    2: (Image.FLIP_LEFT_RIGHT,),
+    3: (Image.ROTATE_180,),
+    4: (Image.FLIP_TOP_BOTTOM,),
+    5: (Image.FLIP_LEFT_RIGHT, Image.ROTATE_90),
+    6: (Image.ROTATE_270,),
+    7: (Image.FLIP_LEFT_RIGHT, Image.ROTATE_270),
+    8: (Image.ROTATE_90,)
+}
+
+def read_orientation(img):
+    """Return the EXIF orientation (tag 274) of an opened image, or 1 if it has none"""
+    try:
+        return img.getexif().get(274, 1)
+    except Exception:
+        return 1  # If EXIF handling fails, continue with original image
+
+def fit_size(img_w, img_h, box_w, box_h):
+    """Largest size with the image's aspect ratio that fits inside the box"""
+    scale = min(box_w / img_w, box_h / img_h)
+    return max(1, int(img_w * scale)), max(1, int(img_h * scale))
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_EXTS) and os.path.isfile(path)
+
+class ArchivePool:
+    """Random access to the images inside ZIP and uncompressed TAR archives
+    
+    An archive is treated as a folder: its members' paths are the archive's
+    path followed by the member name. Member bytes are read straight from the
+    offsets recorded when the archive was indexed, through a small LRU pool of
+    open archive handles, so nothing is extracted to disk.
+    """
+    def __init__(self, max_handles=ARCHIVE_HANDLES):
+        self.max_handles = max_handles
+        self.members = {}  # archive -> paths of its members
+        self.paths = {}  # member path -> (archive, member name, location)
+        self.handles = OrderedDict()  # archive -> (file, lock), least recently used first
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def list_members(archive):
+        """Map the name of every image in an archive to where its bytes are
+        
+        ZIP: ["zip", local header offset, compressed size, compression method, size]
+        TAR: ["tar", data offset, size]
+        """
+        def wanted(name):
+            # Absolute names and ones climbing out of the archive would not map to a path inside it
+            return (os.path.splitext(name)[1].lower() in SUPPORTED_EXTS
+                    and not name.startswith('/') and '..' not in name.split('/'))
+        
+        members = {}
+        try:
+            if zipfile.is_zipfile(archive):
+                with zipfile.ZipFile(archive) as zf:
+                    for info in zf.infolist():
+                        if info.is_dir() or info.flag_bits & 0x1:
+                            continue  # Folders and encrypted members
+                        if wanted(info.filename):
+                            members[info.filename] = ["zip", info.header_offset, info.compress_size,
+                                                      info.compress_type, info.file_size]
+            else:
+                with tarfile.open(archive, "r:") as tf:
+                    for info in tf:
+                        if info.isfile() and wanted(info.name):
+                            members[info.name] = ["tar", info.offset_data, info.size]
+        except (zipfile.BadZipFile, tarfile.TarError) as e:
+            raise OSError(f"Cannot read archive {archive}: {e}") from e
+        return members
+    
+    def register(self, archive, members):
+        table = {os.path.join(archive, name.replace('/', os.sep)): (archive, name, location)
+                 for name, location in members.items()}
+        with self.lock:
+            for path in self.members.get(archive, ()):
+                del self.paths[path]
+            self.members[archive] = list(table)
+            self.paths.update(table)
+    
+    def locate(self, path):
+        """(archive, member name, location) of an archive member's path, or None"""
+        with self.lock:
+            return self.paths.get(path)
+    
+    def stat(self, path):
+        """Stat-like result for a member: the archive's mtime with the member's size, or None"""
+        location = self.locate(path)
+        if location is None:
+            return None
+        st = os.stat(location[0])
+        return SimpleNamespace(st_size=self.member_size(location), st_mtime=st.st_mtime, st_mtime_ns=st.st_mtime_ns)
+    
+    def handle(self, archive):
+        """Pooled (file, lock) for an archive, opening it if needed"""
+        with self.lock:
+            pooled = self.handles.get(archive)
+            if pooled:
+                self.handles.move_to_end(archive)
+                return pooled
+        f = open(archive, 'rb')
+        evicted = []
+        with self.lock:
+            if archive in self.handles:
+                evicted.append((f, threading.Lock()))  # Opened by another thread meanwhile
+            else:
+                self.handles[archive] = (f, threading.Lock())
+            while len(self.handles) > self.max_handles:
+                evicted.append(self.handles.popitem(last=False)[1])
+            pooled = self.handles[archive]
+        for old, old_lock in evicted:
+            with old_lock:
+                old.close()
+        return pooled
+    
+    @staticmethod
+    def decompressor(method, data):
+        """(decompressor, rest of data) for the start of a ZIP member's compressed bytes"""
+        if method == zipfile.ZIP_DEFLATED:
+            return zlib.decompressobj(-15), data
+        if method == zipfile.ZIP_BZIP2:
+            return bz2.BZ2Decompressor(), data
+        if method == zipfile.ZIP_LZMA:
+            # LZMA data starts with a 4-byte version and properties size, then the LZMA1 properties
+            props_size, = struct.unpack("<H", data[2:4])
+            props = data[4:4 + props_size]
+            dict_size, = struct.unpack("<I", props[1:5])
+            lzma_filter = {"id": lzma.FILTER_LZMA1, "dict_size": dict_size,
+                           "lc": props[0] % 9, "lp": props[0] // 9 % 5, "pb": props[0] // 45}
+            return lzma.LZMADecompressor(lzma.FORMAT_RAW, filters=[lzma_filter]), data[4 + props_size:]
+        raise OSError(f"Unsupported ZIP compression method {method}")
+    
+    def read_raw(self, location, start=0, length=None):
+        """Up to length of the member's stored (possibly compressed) bytes, from start on"""
+        archive, name, (kind, offset, size, *method) = location
+        length = size - start if length is None else min(length, size - start)
+        while True:
+            f, lock = self.handle(archive)
+            with lock:
+                if f.closed:
+                    continue  # Evicted from the pool meanwhile
+                if kind == "zip":
+                    # The data follows the local header, whose name and extra field lengths can differ
+                    # from the central directory's
+                    f.seek(offset)
+                    header = f.read(30)
+                    if header[:4] != b"PK\x03\x04":
+                        raise OSError(f"Bad ZIP header for {name} in {archive}")
+                    name_len, extra_len = struct.unpack("<HH", header[26:30])
+                    f.seek(offset + 30 + name_len + extra_len + start)
+                else:
+                    f.seek(offset + start)
+                return f.read(length)
+    
+    @staticmethod
+    def member_size(location):
+        """Uncompressed size of a member, the last field of ZIP and TAR locations alike"""
+        return location[2][-1]
+    
+    @staticmethod
+    def compressed(location):
+        kind, _, _, *method = location[2]
+        return kind == "zip" and method[0] != zipfile.ZIP_STORED
+    
+    def read(self, location, limit=None):
+        """Bytes of the member at a location returned by locate(), or only its first limit bytes"""
+        if not self.compressed(location):
+            return self.read_raw(location, 0, limit)
+        if limit is not None:
+            data = b""
+            for chunk in self.decompressed_chunks(location, limit):
+                data += chunk
+                if len(data) >= limit:
+                    break
+            return data[:limit]
+        decompressor, data = self.decompressor(location[2][3], self.read_raw(location))
+        data = decompressor.decompress(data)
+        if not decompressor.eof:
+            raise OSError(f"Truncated {location[1]} in {location[0]}")
+        return data
+    
+    def decompressed_chunks(self, location, chunk_bytes=ARCHIVE_CHUNK_BYTES):
+        """Yield a compressed member's contents, decompressing chunk_bytes of its data at a time"""
+        size = location[2][2]
+        decompressor = None
+        start = 0
+        while start < size:
+            data = self.read_raw(location, start, chunk_bytes)
+            if not data:
+                return
+            start += len(data)
+            if decompressor is None:
+                decompressor, data = self.decompressor(location[2][3], data)
+            yield decompressor.decompress(data)
+    
+    def tail(self, location, length):
+        """The last length bytes of a member, without holding all of a compressed one in memory"""
+        if not self.compressed(location):
+            return self.read_raw(location, max(0, location[2][2] - length))
+        tail = b""
+        for chunk in self.decompressed_chunks(location):
+            tail = (tail + chunk)[-length:]
+        return tail
+    
+    def close(self):
+        with self.lock:
+            handles = list(self.handles.values())
+            self.handles.clear()
+        for f, lock in handles:
+            with lock:
+                f.close()
+
+ARCHIVES = ArchivePool()
+
+def open_image(source):
+    """Image.open for a file path, an archive member's path, a location from ARCHIVES.locate, or file contents"""
+    if isinstance(source, bytes):
+        return Image.open(io.BytesIO(source))
+    location = source if isinstance(source, tuple) else ARCHIVES.locate(source)
+    if location:
+        return Image.open(io.BytesIO(ARCHIVES.read(location)))
+    return Image.open(source)
+
+def stat_image(path):
+    """os.stat of an image file, or ARCHIVES.stat of an archive member"""
+    return ARCHIVES.stat(path) or os.stat(path)
+
+class ReadAhead:
+    """Reads image files into memory on daemon threads, so a hung file server cannot freeze the slideshow
+    
+    Each configured root has reader threads of its own, so a network share
+    that stalls holds up only its own files, and callers give up after
+    timeout seconds with TimeoutError. fetch() starts reading an upcoming file
+    ahead of its decode; the contents read ahead but not yet claimed by read()
+    are bounded by max_bytes. Reads slower than READ_STALL_MS and calls that
+    timed out are counted per root.
+    """
+    def __init__(self, roots, max_bytes=READ_AHEAD_BYTES, timeout=READ_TIMEOUT):
+        self.roots = list(roots)
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.queues = {}  # root -> queue of (future, function, args) for its reader threads
+        self.pending = {}  # path -> read started by fetch() and not claimed yet
+        self.claimed = set()  # reads no longer waiting for room in the budget
+        self.reserved = {}  # read -> bytes it holds in self.buffered
+        self.buffered = 0
+        self.cond = threading.Condition()
+        self.stalls = {}  # root -> reads slower than READ_STALL_MS
+        self.timeouts = {}  # root -> calls that gave up waiting
+    
+    def root_of(self, path):
+        for root in self.roots:
+            if path == root or path.startswith(root.rstrip(os.sep) + os.sep):
+                return root
+        return None
+    
+    def submit(self, path, function, *args):
+        root = self.root_of(path)
+        with self.cond:
+            jobs = self.queues.get(root)
+            if jobs is None:
+                jobs = self.queues[root] = queue.Queue()
+                for _ in range(READ_WORKERS_PER_ROOT):
+                    threading.Thread(target=self.run, args=(jobs,), daemon=True).start()
+        future = Future()
+        jobs.put((future, function, args))
+        return future
+    
+    @staticmethod
+    def run(jobs):
+        while True:
+            future, function, args = jobs.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(function(future, *args))
+            except BaseException as e:
+                future.set_exception(e)
+    
+    def wait(self, path, future, cancel=True, timeout=None):
+        try:
+            return future.result(self.timeout if timeout is None else timeout)
+        except FutureTimeoutError:
+            if cancel:
+                future.cancel()
+            root = self.root_of(path)
+            with self.cond:
+                self.timeouts[root] = self.timeouts.get(root, 0) + 1
+            raise TimeoutError(f"Reading {path} took longer than {self.timeout:g}s") from None
+    
+    def note_time(self, path, seconds):
+        if seconds * 1000 > READ_STALL_MS:
+            root = self.root_of(path)
+            with self.cond:
+                self.stalls[root] = self.stalls.get(root, 0) + 1
+    
+    def _stat(self, future, path):
+        start = time.monotonic()
+        try:
+            return stat_image(path)
+        finally:
+            self.note_time(path, time.monotonic() - start)
+    
+    def stat(self, path):
+        """stat_image(path), giving up after the timeout"""
+        return self.wait(path, self.submit(path, self._stat, path))
+    
+    def stat_all(self, paths):
+        """stat() of several paths at once, with None for those that failed
+        
+        The calls run in parallel and share one timeout. Once a root has timed
+        out, the rest of its paths are not waited for.
+        """
+        futures = [self.submit(path, self._stat, path) for path in paths]
+        deadline = time.monotonic() + self.timeout
+        stalled = set()
+        results = []
+        for path, future in zip(paths, futures):
+            root = self.root_of(path)
+            if root in stalled:
+                future.cancel()
+                results.append(None)
+                continue
+            try:
+                results.append(self.wait(path, future, timeout=max(0, deadline - time.monotonic())))
+            except TimeoutError:
+                stalled.add(root)
+                results.append(None)
+            except OSError:
+                results.append(None)
+        return results
+    
+    def _read(self, future, path, skip):
+        start = time.monotonic()
+        st = stat_image(path)
+        if skip and skip(path, st):
+            self.note_time(path, time.monotonic() - start)
+            return st, None
+        stat_s = time.monotonic() - start
+        with self.cond:
+            while (future not in self.claimed and self.buffered
+                   and self.buffered + st.st_size > self.max_bytes):
+                self.cond.wait()
+            self.buffered += st.st_size
+            self.reserved[future] = st.st_size
+        start = time.monotonic()
+        try:
+            location = ARCHIVES.locate(path)
+            if location:
+                return st, ARCHIVES.read(location)
+            with open(path, 'rb') as f:
+                return st, f.read()
+        finally:
+            self.note_time(path, stat_s + time.monotonic() - start)
+    
+    def fetch(self, path, skip=None):
+        """Start reading path ahead of its decode, unless skip(path, stat) says its frame is cached"""
+        with self.cond:
+            if path not in self.pending:
+                self.pending[path] = self.submit(path, self._read, path, skip)
+    
+    def read(self, path, skip=None, share=False):
+        """Return (stat, contents) of an image file or archive member, contents None if skip(path, stat)
+        
+        With share, a read started by fetch() is waited on but left for the
+        caller that claims it, so a preview does not read the file twice.
+        """
+        with self.cond:
+            future = self.pending.get(path) if share else self.pending.pop(path, None)
+            own = future is None or not share
+            if future is None:
+                future = self.submit(path, self._read, path, skip)
+            if own:
+                self.claimed.add(future)
+                self.cond.notify_all()
+        try:
+            st, data = self.wait(path, future, cancel=own)
+        finally:
+            if own:
+                # The caller holds the contents from here on; a read that timed out gives its room back once it ends
+                future.add_done_callback(self.release)
+        if data is None and skip is None:
+            # The read ahead found the frame cached, but this caller needs the contents
+            return self.read(path)
+        return st, data
+    
+    def drop(self, path):
+        """Forget a read started by fetch() that is no longer wanted"""
+        with self.cond:
+            future = self.pending.pop(path, None)
+            if future is None:
+                return
+            self.claimed.add(future)
+            self.cond.notify_all()
+        future.cancel()
+        future.add_done_callback(self.release)
+    
+    def release(self, future):
+        with self.cond:
+            self.buffered -= self.reserved.pop(future, 0)
+            self.claimed.discard(future)
+            self.cond.notify_all()
+    
+    def report(self):
+        """A line for each root with slow or timed out reads"""
+        with self.cond:
+            roots = set(self.stalls) | set(self.timeouts)
+            return [f"{self.stalls.get(root, 0)} slow reads, {self.timeouts.get(root, 0)} timeouts: {root}"
+                    for root in sorted(roots, key=str)]
+
+def probe_image(path):
+    """Read only an image's header: [width, height, format, orientation, frames]
+    
+    Raises if the file is not an image Pillow can identify, or if a PNG is
+    visibly truncated (no IEND chunk at the end).
+    """
+    def header(source):
+        with open_image(source) as img:
+            return [img.width, img.height, img.format, read_orientation(img), getattr(img, "n_frames", 1)]
+    
+    location = ARCHIVES.locate(path)
+    if location is None:
+        info = header(path)
+        if info[2] == "PNG":
+            with open(path, 'rb') as f:
+                f.seek(-8, os.SEEK_END)
+                end = f.read(8)
+    else:
+        # Archive members are read only as far as a header needs, as Image.open does with a file
+        data = ARCHIVES.read(location, PROBE_HEADER_BYTES)
+        complete = len(data) >= ARCHIVES.member_size(location)
+        try:
+            info = header(data)
+        except Exception:
+            if complete:
+                raise
+            info = None  # The header does not fit in the prefix
+        # Counting GIF frames means reading all of them
+        if not complete and (info is None or info[2] == "GIF"):
+            data = ARCHIVES.read(location)
+            complete = True
+            info = header(data)
+        if info[2] == "PNG":
+            end = data[-8:] if complete else ARCHIVES.tail(location, 8)
+    if info[2] == "PNG" and end[:4] != b"IEND":
+        raise OSError("truncated PNG file")
+    return info
+
+def oriented_fit(img, orientation, screen_w, screen_h):
+    """Size to scale img to, fitting the screen as seen before the EXIF rotation is applied"""
+    if orientation in (5, 6, 7, 8):
+        return fit_size(img.width, img.height, screen_h, screen_w)
+    return fit_size(img.width, img.height, screen_w, screen_h)
+
+def load_scaled_image(path, screen_w, screen_h, orientation=None, timings=None):
+    """Open an image, scale it to fit the screen and apply its EXIF orientation
+    
+    Oversized sources are decoded at reduced resolution (JPEG DCT scaling or an
+    integer reduce) before the final LANCZOS resample. The estimated peak pixel
+    memory is stored in the returned image's info["peak_bytes"]. If timings is
+    a dict, the seconds spent in each phase are added to it. path can be
+    anything open_image accepts.
+    """
+    last = [time.perf_counter()]
+    def mark(phase):
+        if timings is not None:
+            now = time.perf_counter()
+            timings[phase] = timings.get(phase, 0) + now - last[0]
+            last[0] = now
+    
+    img = open_image(path)
+    if orientation is None:
+        orientation = read_orientation(img)
+    mark("open")
+    
+    new_w, new_h = oriented_fit(img, orientation, screen_w, screen_h)
+    
+    # Let the JPEG decoder scale down by 1/2, 1/4 or 1/8 while decoding
+    if img.format in DRAFT_FORMATS and new_w < img.width:
+        img.draft("RGB", (new_w, new_h))
+    
+    decoded_bytes = img.width * img.height * Image.getmodebands(img.mode)
+    if decoded_bytes > MAX_DECODE_BYTES:
+        raise MemoryError(f"Decoding {img.width}x{img.height} would need "
+                          f"{decoded_bytes // (1024 * 1024)} MB")
+    peak_bytes = decoded_bytes
+    img.load()
+    mark("decode")
+    
+    # Cheap integer reduction, leaving enough pixels for a high-quality resample
+    factor = int(min(img.width / new_w, img.height / new_h) / REDUCE_GAP)
+    if factor > 1 and img.mode not in ("1", "P") and not img.mode.startswith("I;16"):
+        img = img.reduce(factor)
+        peak_bytes += img.width * img.height * Image.getmodebands(img.mode)
+    mark("reduce")
+    
+    img = img.resize((new_w, new_h), Image.LANCZOS)
+    mark("resize")
+    
+    # Transposing the screen-sized frame is much cheaper than the original
+    for transform in ORIENTATION_TRANSFORMS.get(orientation, ()):
+        img = img.transpose(transform)
+    mark("orient")
+    
+    img.info["peak_bytes"] = peak_bytes + new_w * new_h * Image.getmodebands(img.mode)
+    return img
+
+def load_preview_image(path, screen_w, screen_h):
+    """Quick low-quality version of load_scaled_image, shown until the full frame is ready
+    
+    Only formats the decoder can scale down while decoding get a preview:
+    elsewhere the full decode dominates and a preview would save nothing.
+    Returns None for those. path can be anything open_image accepts.
+    """
+    img = open_image(path)
+    if img.format not in DRAFT_FORMATS:
+        return None
+    orientation = read_orientation(img)
+    new_w, new_h = oriented_fit(img, orientation, screen_w, screen_h)
+    img.draft("RGB", (max(1, new_w // PREVIEW_SCALE), max(1, new_h // PREVIEW_SCALE)))
+    img = img.resize((new_w, new_h), Image.BILINEAR)
+    for transform in ORIENTATION_TRANSFORMS.get(orientation, ()):
+        img = img.transpose(transform)
+    return img
+
+# Shared memory blocks a decode worker process has attached to, by name
+_worker_blocks = {}
+
+def decode_to_shared_memory(path, screen_w, screen_h, orientation, block_name, want_timings):
+    """Decode worker: scale an image with load_scaled_image and write its pixels to a shared memory block
+    
+    Returns ((mode, size, byte count, info, palette), timings), or the image
+    itself in place of the tuple if it does not fit the block.
+    """
+    timings = {} if want_timings else None
+    img = load_scaled_image(path, screen_w, screen_h, orientation, timings)
+    block = _worker_blocks.get(block_name)
+    if block is None:
+        block = _worker_blocks[block_name] = shared_memory.SharedMemory(name=block_name)
+    data = img.tobytes()
+    if len(data) > block.size:
+        return img, timings
+    block.buf[:len(data)] = data
+    return (img.mode, img.size, len(data), img.info, img.getpalette()), timings
+
+class ProcessDecoder:
+    """Runs load_scaled_image in worker processes, handing the pixels back through shared memory
+    
+    Each decode in flight borrows one of a fixed set of screen-sized shared
+    memory blocks, so only the frame's mode, size and info are pickled. If the
+    worker pool breaks, frames are decoded in the calling thread instead.
+    """
+    def __init__(self, workers, screen_w, screen_h):
+        self.screen_w = screen_w
+        self.screen_h = screen_h
+        self.broken = False
+        self.closed = False
+        self.lock = threading.Lock()
+        self.pool = None
+        self.free_blocks = queue.Queue()  # None once closed, waking up threads waiting for a block
+        try:
+            for _ in range(workers):
+                # Four bytes per pixel covers every mode a frame is converted to
+                self.free_blocks.put(shared_memory.SharedMemory(create=True, size=screen_w * screen_h * 4))
+            self.pool = ProcessPoolExecutor(max_workers=workers)
+        except Exception:
+            self.close()
+            raise
+    
+    def decode(self, source, orientation=None, timings=None):
+        """load_scaled_image(source) in a worker; source is a path or the file's contents"""
+        block = None if self.broken or self.closed else self.free_blocks.get()
+        if block is None:
+            self.free_blocks.put(None)
+            return load_scaled_image(source, self.screen_w, self.screen_h, orientation, timings)
+        try:
+            try:
+                # Archive members are passed by location, since workers have not indexed the archives
+                if isinstance(source, str):
+                    source = ARCHIVES.locate(source) or source
+                future = self.pool.submit(decode_to_shared_memory, source, self.screen_w, self.screen_h,
+                                          orientation, block.name, timings is not None)
+                result, worker_timings = future.result()
+            except (RuntimeError, CancelledError) as e:
+                # The pool broke or is shutting down (errors raised while decoding are raised again here)
+                if isinstance(e, BrokenProcessPool) and not self.closed and not self.broken:
+                    self.broken = True
+                    print(f"Error in decode processes, decoding in-process: {e}")
+                return load_scaled_image(source, self.screen_w, self.screen_h, orientation, timings)
+            if timings is not None:
+                timings.update(worker_timings)
+            if isinstance(result, Image.Image):
+                return result
+            
+            start = time.perf_counter()
+            mode, size, length, info, palette = result
+            with block.buf[:length] as pixels:
+                img = Image.frombytes(mode, size, pixels)
+            img.info.update(info)
+            if palette:
+                img.putpalette(palette)
+            if timings is not None:
+                timings["handoff"] = time.perf_counter() - start
+            return img
+        finally:
+            with self.lock:
+                if not self.closed:
+                    self.free_blocks.put(block)
+                    block = None
+            if block:
+                self.free_block(block)
+    
+    @staticmethod
+    def free_block(block):
+        block.close()
+        block.unlink()
+    
+    def close(self):
+        """Stop the workers without waiting for decodes in flight and free the shared memory
+        
+        Blocks still borrowed are freed when their decode returns.
+        """
+        with self.lock:
+            self.closed = True
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+        while True:
+            try:
+                block = self.free_blocks.get_nowait()
+            except queue.Empty:
+                break
+            if block:
+                self.free_block(block)
+        self.free_blocks.put(None)
+
+class Animation:
+    """Frames of an animated image, decoded and scaled one at a time as playback needs them
+    
+    load() runs on a worker thread; with read, the file is read through it,
+    so a hung share times out. Scaled frames are kept while they fit in
+    max_bytes, so short animations are only decoded once; the rest are
+    decoded again on every loop. Playback itself is driven by ImageViewer.
+    """
+    def __init__(self, path, screen_w, screen_h, orientation=None, max_bytes=ANIMATION_CACHE_BYTES, read=None):
+        self.path = path
+        self.read = read  # Returns the file's contents, or None to open the path directly
+        self.screen_w = screen_w
+        self.screen_h = screen_h
+        self.orientation = orientation
+        self.max_bytes = max_bytes
+        self.img = None
+        self.size = None
+        self.n_frames = None
+        self.frames = {}  # frame number -> (scaled frame, duration in ms)
+        self.total_bytes = 0
+        self.lock = threading.Lock()  # One decode at a time
+        self.closed = False
+        # Playback state, kept by ImageViewer.animate
+        self.future = None  # Decode of the frame after the one on screen
+        self.shown = None  # Frame number on screen
+        self.due = None  # When the next frame is due (time.monotonic)
+        self.loop_done = False
+    
+    def load(self, n):
+        """Return (scaled frame, duration in ms) of frame n, or None once closed or for a still image"""
+        with self.lock:
+            if self.closed:
+                self._release()
+                return None
+            cached = self.frames.get(n)
+            if cached:
+                return cached
+            if self.img is None:
+                self.img = open_image(self.read(self.path) if self.read else self.path)
+                self.n_frames = getattr(self.img, "n_frames", 1)
+                if self.n_frames <= 1:
+                    # A still image: the slide on screen is all there is, so skip decoding it again
+                    self._release()
+                    return None
+                if self.orientation is None:
+                    self.orientation = read_orientation(self.img)
+                self.size = oriented_fit(self.img, self.orientation, self.screen_w, self.screen_h)
+            
+            self.img.seek(n)
+            duration = self.img.info.get("duration") or 0
+            if duration <= 10:
+                duration = ANIMATION_DEFAULT_FRAME_MS
+            frame = self.img
+            if frame.mode not in ("RGB", "RGBA"):
+                transparent = "transparency" in frame.info or frame.mode in ("LA", "PA")
+                frame = frame.convert("RGBA" if transparent else "RGB")
+            frame = frame.resize(self.size, Image.LANCZOS)
+            for transform in ORIENTATION_TRANSFORMS.get(self.orientation, ()):
+                frame = frame.transpose(transform)
+            
+            result = (frame, duration)
+            frame_bytes = FrameCache.frame_bytes(frame)
+            if self.total_bytes + frame_bytes <= self.max_bytes:
+                self.frames[n] = result
+                self.total_bytes += frame_bytes
+            if self.closed:
+                self._release()
+                return None
+            return result
+    
+    def _release(self):
+        if self.img is not None:
+            self.img.close()
+            self.img = None
+        self.frames.clear()
+    
+    def close(self):
+        """Stop the animation; a decode in progress releases the file when it finishes"""
+        self.closed = True
+        if self.future:
+            self.future.cancel()
+        if self.lock.acquire(blocking=False):
+            try:
+                self._release()
+            finally:
+                self.lock.release()
+
+class FrameCache:
+    """Thread-safe LRU cache of scaled frames, evicted by total pixel bytes"""
+    def __init__(self, max_bytes=FRAME_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.frames = OrderedDict()
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def frame_bytes(img):
+        return img.width * img.height * len(img.getbands())
+    
+    def get(self, key):
+        with self.lock:
+            img = self.frames.get(key)
+            if img is not None:
+                self.frames.move_to_end(key)
+            return img
+    
+    def put(self, key, img):
+        size = self.frame_bytes(img)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.frames.pop(key, None)
+            if old is not None:
+                self.total_bytes -= self.frame_bytes(old)
+            self.frames[key] = img
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.frames.popitem(last=False)
+                self.total_bytes -= self.frame_bytes(evicted)
+    
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.frames
+    
+    def latest(self, path):
+        """Most recently used frame of a file, whatever its mtime or screen size, without touching the file"""
+        with self.lock:
+            for key in reversed(self.frames):
+                if key[0] == path:
+                    return self.frames[key]
+        return None
+    
+    def invalidate(self, path):
+        """Drop every cached frame of a file, whatever its mtime or screen size"""
+        with self.lock:
+            for key in [k for k in self.frames if k[0] == path]:
+                self.total_bytes -= self.frame_bytes(self.frames.pop(key))
+
+class DiskCache:
+    """Persistent LRU cache of screen-sized renders, written by a background thread
+    
+    Entries are named after a hash of the source path, size, mtime and target
+    resolution, so a changed file or screen simply misses. Reads refresh the
+    entry's mtime, which is what eviction uses as last-access time.
+    """
+    def __init__(self, folder=None, max_bytes=DISK_CACHE_BYTES):
+        self.folder = folder or app_file(".cache")
+        self.max_bytes = max_bytes
+        self.entries = {}  # file name -> [size, last access]
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.writer = ThreadPoolExecutor(max_workers=1)
+        self.writer.submit(self._load_index)
+    
+    @staticmethod
+    def key(path, st, screen_w, screen_h):
+        raw = f"{path}|{st.st_size}|{st.st_mtime_ns}|{screen_w}x{screen_h}"
+        return hashlib.sha1(raw.encode("utf-8", "surrogateescape")).hexdigest()
+    
+    def _load_index(self):
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            with os.scandir(self.folder) as it:
+                for entry in it:
+                    if entry.name.endswith(".tmp"):
+                        os.remove(entry.path)  # Left over from an interrupted write
+                        continue
+                    st = entry.stat()
+                    with self.lock:
+                        self.entries[entry.name] = [st.st_size, st.st_mtime]
+                        self.total_bytes += st.st_size
+            self._evict()
+        except Exception as e:
+            print(f"Error loading render cache: {e}")
+    
+    def get(self, key):
+        """Return the cached render for key, or None"""
+        for name in (key + ".jpg", key + ".png"):
+            file_path = os.path.join(self.folder, name)
+            try:
+                img = Image.open(file_path)
+                img.load()
+            except OSError:
+                continue
+            try:
+                os.utime(file_path)
+            except OSError:
+                pass
+            with self.lock:
+                if name in self.entries:
+                    self.entries[name][1] = time.time()
+            return img
+        return None
+    
+    def __contains__(self, key):
+        return any(os.path.exists(os.path.join(self.folder, key + ext)) for ext in (".jpg", ".png"))
+    
+    def put(self, key, img, wait=False):
+        """Queue a render to be written to the cache, or write it right away with wait"""
+        if self.max_bytes > 0:
+            if wait:
+                self._write(key, img)
+            else:
+                self.writer.submit(self._write, key, img)
+    
+    def _write(self, key, img):
+        name = key + (".jpg" if img.mode in ("RGB", "L", "CMYK") else ".png")
+        file_path = os.path.join(self.folder, name)
+        try:
+            img.save(file_path + ".tmp", "JPEG" if name.endswith(".jpg") else "PNG", quality=90)
+            os.replace(file_path + ".tmp", file_path)
+            size = os.path.getsize(file_path)
+        except Exception as e:
+            print(f"Error writing render cache: {e}")
+            return
+        with self.lock:
+            old = self.entries.get(name)
+            if old:
+                self.total_bytes -= old[0]
+            self.entries[name] = [size, time.time()]
+            self.total_bytes += size
+        self._evict()
+    
+    def _evict(self):
+        with self.lock:
+            if self.total_bytes <= self.max_bytes:
+                return
+            by_age = sorted(self.entries.items(), key=lambda item: item[1][1])
+            victims = []
+            for name, (size, _) in by_age:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                del self.entries[name]
+                self.total_bytes -= size
+                victims.append(name)
+        for name in victims:
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError:
+                pass
+    
+    def close(self):
+        self.writer.shutdown(wait=False, cancel_futures=True)
+
+class FileIndex:
+    """Persistent record of the images found in every folder, with folder mtimes
+    
+    A folder's mtime changes whenever entries are added, removed or renamed in
+    it, so folders whose mtime still matches are taken from the index instead
+    of being listed again. Every folder is still stat'ed to find the changes.
+    """
+    VERSION = 1
+    
+    def __init__(self, path=None):
+        self.path = path or app_file(".index")
+        # folder -> {"mtime": ns, "files": [...], "subdirs": [...], "meta": {name: probe}}
+        # where a probe is [mtime_ns, size, width, height, format, orientation, frames],
+        # or [mtime_ns, size, error] for files that are not readable images
+        self.dirs = {}
+        # archive -> {"mtime": ns, "size": bytes, "members": {name: location}}, see ArchivePool.list_members
+        self.archives = {}
+        self.stats = {"dirs": 0, "rescanned": 0, "files": 0}
+        self.root_times = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION:
+                self.dirs = data["dirs"]
+                self.archives = data.get("archives", {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error loading file index: {e}")
+    
+    def save(self):
+        try:
+            dirs = dict(self.dirs)  # The folder watcher may add folders meanwhile
+            with open(self.path + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump({"version": self.VERSION, "dirs": dirs, "archives": self.archives}, f)
+            os.replace(self.path + ".tmp", self.path)
+        except Exception as e:
+            print(f"Error saving file index: {e}")
+    
+    @staticmethod
+    def list_dir(folder):
+        """List image files and subfolders the way os.walk does (symlinked folders are not followed)"""
+        files, subdirs = [], []
+        with os.scandir(folder) as it:
+            for entry in it:
+                # The entry type comes with the listing, so this needs no extra stat call
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    if not entry.is_symlink():
+                        subdirs.append(entry.name)
+                elif os.path.splitext(entry.name)[1].lower() in SUPPORTED_EXTS:
+                    files.append(entry.name)
+        return files, subdirs
+    
+    def scan(self, folders, rebuild=False):
+        """Return every image under folders, re-listing only folders that changed"""
+        return [path for _, batch in self.iter_scan(folders, rebuild) for path in batch]
+    
+    def scan_dir(self, folder, rebuild):
+        """Return the index entry of one folder and whether it had to be listed"""
+        mtime = os.stat(folder).st_mtime_ns
+        entry = None if rebuild else self.dirs.get(folder)
+        if entry and entry["mtime"] == mtime:
+            return entry, False
+        names, subdirs = self.list_dir(folder)
+        new_entry = {"mtime": mtime, "files": names, "subdirs": subdirs}
+        old_meta = self.dirs.get(folder, {}).get("meta")
+        if old_meta:
+            # Probe results stay valid for files that are still there (they carry their own mtime)
+            new_entry["meta"] = {name: old_meta[name] for name in names if name in old_meta}
+        return new_entry, True
+    
+    def scan_archive(self, archive, rebuild):
+        """Return the index entry of one archive and whether its members had to be listed"""
+        st = os.stat(archive)
+        entry = None if rebuild else self.archives.get(archive)
+        if (entry and entry["mtime"] == st.st_mtime_ns and entry["size"] == st.st_size
+                and all(len(location) == 5 for location in entry["members"].values()
+                        if location[0] == "zip")):  # Indexed before member sizes were recorded
+            return entry, False
+        return {"mtime": st.st_mtime_ns, "size": st.st_size, "members": ArchivePool.list_members(archive)}, True
+    
+    def meta_entry(self, path):
+        """(index entry holding the probe records of path, or None, and the record's name)
+        
+        Archive members are recorded in their archive's entry, under their
+        path inside it, so the records are dropped when the archive changes.
+        """
+        location = ARCHIVES.locate(path)
+        if location:
+            return self.archives.get(location[0]), path[len(location[0]) + 1:]
+        folder, name = os.path.split(path)
+        return self.dirs.get(folder), name
+    
+    def metadata(self, path, st=None):
+        """Probe result for a file, if one was recorded for its current mtime and size
+        
+        Without st the last probe result is returned unchecked.
+        """
+        entry, name = self.meta_entry(path)
+        meta = (entry or {}).get("meta", {}).get(name)
+        if meta and (st is None or (meta[0] == st.st_mtime_ns and meta[1] == st.st_size)):
+            return meta[2:]
+        return None
+    
+    def iter_scan(self, folders, rebuild=False, workers=SCAN_WORKERS):
+        """Yield (root, paths) for the images of each folder as it is reached; the index is saved once the scan completes
+        
+        Folders of all roots are listed concurrently by a bounded thread pool,
+        so one slow share does not hold up the others. The wall time until each
+        root was fully scanned ends up in root_times. Roots that are archives
+        are indexed by their member list, and registered with ARCHIVES.
+        """
+        dirs = {}
+        archives = {}
+        self.stats = {"dirs": 0, "rescanned": 0, "files": 0}
+        self.root_times = {}
+        start = time.perf_counter()
+        pending = {}  # future -> (folder, root)
+        remaining = {}  # root -> folders still being scanned
+        
+        pool = ThreadPoolExecutor(max_workers=workers)
+        try:
+            def submit(folder, root):
+                if folder in dirs:
+                    return
+                dirs[folder] = None  # Reserve, so a folder is scanned only once
+                pending[pool.submit(self.scan_dir, folder, rebuild)] = (folder, root)
+                remaining[root] = remaining.get(root, 0) + 1
+            
+            for root in folders:
+                if is_archive(root):
+                    pending[pool.submit(self.scan_archive, root, rebuild)] = (None, root)
+                    remaining[root] = 1
+                else:
+                    submit(root, root)
+            
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    folder, root = pending.pop(future)
+                    if folder is None:
+                        yield from self.archive_done(future, root, archives)
+                        self.root_times[root] = time.perf_counter() - start
+                        continue
+                    try:
+                        entry, rescanned = future.result()
+                    except OSError:
+                        entry = None  # Unreadable folders are skipped, as with os.walk
+                        del dirs[folder]
+                    if entry:
+                        dirs[folder] = entry
+                        self.stats["dirs"] += 1
+                        self.stats["rescanned"] += rescanned
+                        for sub in entry["subdirs"]:
+                            submit(os.path.join(folder, sub), root)
+                    remaining[root] -= 1
+                    if not remaining[root]:
+                        self.root_times[root] = time.perf_counter() - start
+                    if entry and entry["files"]:
+                        self.stats["files"] += len(entry["files"])
+                        yield root, [os.path.join(folder, name) for name in entry["files"]]
+        finally:
+            # Stop queued listings if the consumer gives up early
+            pool.shutdown(wait=False, cancel_futures=True)
+        
+        changed = (self.stats["rescanned"] > 0 or dirs.keys() != self.dirs.keys()
+                   or archives.keys() != self.archives.keys())
+        self.dirs = dirs
+        self.archives = archives
+        if changed:
+            self.save()
+    
+    def archive_done(self, future, archive, archives):
+        """Record a finished archive listing and yield its images as one batch"""
+        try:
+            entry, rescanned = future.result()
+        except OSError as e:
+            print(f"Error indexing archive: {e}")
+            return
+        archives[archive] = entry
+        ARCHIVES.register(archive, entry["members"])
+        self.stats["dirs"] += 1
+        self.stats["rescanned"] += rescanned
+        if entry["members"]:
+            self.stats["files"] += len(entry["members"])
+            yield archive, [os.path.join(archive, name.replace('/', os.sep)) for name in entry["members"]]
+
+class FrameStats:
+    """Rolling per-phase timings (ms), summarized as p50/p95/max and exported to a JSON file
+    
+    record() may be called from any thread; deque appends are atomic.
+    """
+    def __init__(self, path=None, window=STATS_WINDOW):
+        self.path = path or app_file(".stats.json")
+        self.window = window
+        self.samples = {}  # phase -> deque of recent durations in ms
+        self.counts = {}  # phase -> samples recorded this session
+    
+    def record(self, phase, seconds):
+        samples = self.samples.get(phase)
+        if samples is None:
+            samples = self.samples.setdefault(phase, deque(maxlen=self.window))
+        samples.append(seconds * 1000)
+        self.counts[phase] = self.counts.get(phase, 0) + 1
+    
+    def record_all(self, timings):
+        for phase, seconds in timings.items():
+            self.record(phase, seconds)
+    
+    def summary(self):
+        result = {}
+        for phase, samples in list(self.samples.items()):
+            values = sorted(samples)
+            if values:
+                result[phase] = {"count": self.counts.get(phase, 0),
+                                 "p50": values[len(values) // 2],
+                                 "p95": values[min(len(values) - 1, len(values) * 95 // 100)],
+                                 "max": values[-1]}
+        return result
+    
+    def overlay_text(self):
+        lines = [f"{phase:<12}{s['p50']:8.1f}{s['p95']:8.1f}{s['max']:8.1f}"
+                 for phase, s in sorted(self.summary().items())]
+        return "\n".join([f"{'ms':<12}{'p50':>8}{'p95':>8}{'max':>8}"] + lines)
+    
+    def export(self):
+        try:
+            with open(self.path + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump({"time": time.time(), "window": self.window, "phases": self.summary()}, f, indent=1)
+            os.replace(self.path + ".tmp", self.path)
+        except Exception as e:
+            print(f"Error saving stats: {e}")
+
+class Quarantine:
+    """Persistent record of images that failed to load, keyed by path and mtime
+    
+    A quarantined file is skipped until its mtime changes. A changed file is
+    tried again, but after QUARANTINE_MAX_ATTEMPTS failures it stays skipped
+    until it is cleared from the configuration dialog.
+    """
+    SAVE_INTERVAL = 5.0
+    
+    def __init__(self, path=None):
+        self.path = path or app_file(".quarantine")
+        self.records = {}  # path -> {"mtime": ns, "attempts": n, "error": str, "time": seconds}
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.last_save = 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.records = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error loading quarantine: {e}")
+    
+    def __contains__(self, path):
+        return path in self.records
+    
+    def __len__(self):
+        return len(self.records)
+    
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            records = dict(self.records)
+            self.dirty = False
+            self.last_save = time.monotonic()
+        try:
+            with open(self.path + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump(records, f, indent=1)
+            os.replace(self.path + ".tmp", self.path)
+        except Exception as e:
+            print(f"Error saving quarantine: {e}")
+    
+    def record(self, path, st, error):
+        """Note a failed load of path, whose stat result was st"""
+        with self.lock:
+            old = self.records.get(path)
+            attempts = 1
+            if old:
+                # The same unchanged file failing again is not a new attempt
+                attempts = old["attempts"] + (old["mtime"] != st.st_mtime_ns)
+            self.records[path] = {"mtime": st.st_mtime_ns, "attempts": attempts,
+                                  "error": str(error) or type(error).__name__, "time": time.time()}
+            self.dirty = True
+            save_due = time.monotonic() - self.last_save > self.SAVE_INTERVAL
+        if save_due:
+            self.save()
+    
+    def blocks(self, path):
+        """Whether path should be skipped; only quarantined files are stat'ed"""
+        record = self.records.get(path)
+        if record is None:
+            return False
+        if record["attempts"] >= QUARANTINE_MAX_ATTEMPTS:
+            return True
+        try:
+            return stat_image(path).st_mtime_ns == record["mtime"]
+        except OSError:
+            return True
+    
+    def release(self, path):
+        """Forget a file that loaded successfully"""
+        if path in self.records:
+            with self.lock:
+                self.records.pop(path, None)
+                self.dirty = True
+    
+    def remove(self, paths):
+        with self.lock:
+            for path in paths:
+                self.records.pop(path, None)
+            self.dirty = True
+        self.save()
+    
+    def clear(self):
+        self.remove(list(self.records))
+
+class MetadataProbe:
+    """Background thread reading the headers of indexed images
+    
+    Results are stored in the file index's "meta" records, so unchanged files
+    are not probed again in later sessions. Files that turn out not to be
+    readable images are quarantined and reported through on_bad(paths) from
+    the probe thread.
+    """
+    def __init__(self, index, quarantine, on_bad):
+        self.index = index
+        self.quarantine = quarantine
+        self.on_bad = on_bad
+        self.pending = queue.Queue()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.probed = 0
+        self.bad = 0
+    
+    def start(self):
+        for folder, entry in list(self.index.dirs.items()):
+            self.pending.put([os.path.join(folder, name) for name in entry["files"]])
+        for archive, entry in list(self.index.archives.items()):
+            self.pending.put([os.path.join(archive, name.replace('/', os.sep)) for name in entry["members"]])
+        self.thread.start()
+    
+    def stop(self):
+        self.stop_event.set()
+        self.pending.put(None)
+    
+    def add(self, paths):
+        """Probe images that appeared after the initial scan"""
+        self.pending.put(list(paths))
+    
+    def probe(self, path):
+        """Return the error of an unreadable image, or None; probes only if the record is stale"""
+        entry, name = self.index.meta_entry(path)
+        if entry is None:
+            return None
+        try:
+            st = stat_image(path)
+        except OSError:
+            return None  # Gone; the folder watcher takes care of it
+        meta = entry.setdefault("meta", {})
+        record = meta.get(name)
+        if not record or record[0] != st.st_mtime_ns or record[1] != st.st_size:
+            try:
+                record = [st.st_mtime_ns, st.st_size] + probe_image(path)
+            except Exception as e:
+                record = [st.st_mtime_ns, st.st_size, str(e) or type(e).__name__]
+            meta[name] = record
+            self.probed += 1
+            if self.probed % PROBE_SAVE_EVERY == 0:
+                self.index.save()
+        if len(record) == 3:
+            self.quarantine.record(path, st, record[2])
+            return record[2]
+        return None
+    
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                paths = self.pending.get(timeout=1.0)
+            except queue.Empty:
+                if self.probed:
+                    self.index.save()
+                    print(f"Probed {self.probed} image headers, {self.bad} unreadable")
+                    self.probed = self.bad = 0
+                continue
+            if paths is None:
+                break
+            bad = []
+            for path in paths:
+                if self.stop_event.is_set():
+                    break
+                error = self.probe(path)
+                if error:
+                    bad.append(path)
+            if bad:
+                self.bad += len(bad)
+                self.on_bad(bad)
+
+class FolderWatcher:
+    """Background thread reporting images added to or removed from indexed folders
+    
+    Uses inotify on Linux and falls back to polling folder mtimes elsewhere.
+    Changed folders are collected until things have been quiet for
+    WATCH_DEBOUNCE seconds, then re-listed against the index and reported as
+    one on_change(added, removed) call from the watcher thread.
+    """
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_IGNORED = 0x8000
+    IN_Q_OVERFLOW = 0x4000
+    IN_ONLYDIR = 0x1000000
+    IN_NONBLOCK = 0x800
+    IN_CLOEXEC = 0x80000
+    WATCH_MASK = (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO |
+                  IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+    EVENT_HEADER = struct.Struct("iIII")
+    
+    def __init__(self, index, on_change):
+        self.index = index
+        self.on_change = on_change
+        self.stop_event = threading.Event()
+        self.changed = set()
+        self.first_change = self.last_change = 0
+        self.mtimes = {folder: entry["mtime"] for folder, entry in index.dirs.items()}
+        self.libc = None
+        self.inotify_fd = None
+        self.watches = {}  # inotify watch descriptor -> folder
+        self.thread = threading.Thread(target=self.run, daemon=True)
+    
+    def start(self):
+        self.start_inotify()
+        self.thread.start()
+    
+    def stop(self):
+        self.stop_event.set()
+    
+    def start_inotify(self):
+        """Watch every indexed folder with inotify, or leave inotify_fd unset to poll instead"""
+        if not sys.platform.startswith("linux"):
+            return
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+            if fd < 0:
+                return
+            self.inotify_fd = fd
+            for folder in self.index.dirs:
+                if not self.add_watch(folder):
+                    # Most likely out of watches (fs.inotify.max_user_watches)
+                    os.close(fd)
+                    self.inotify_fd = None
+                    self.watches.clear()
+                    return
+        except Exception as e:
+            print(f"inotify unavailable, polling folders instead: {e}")
+            self.inotify_fd = None
+    
+    def add_watch(self, folder):
+        wd = self.libc.inotify_add_watch(self.inotify_fd, os.fsencode(folder), self.WATCH_MASK)
+        if wd < 0:
+            return ctypes.get_errno() in (2, 13, 20)  # Gone or unreadable folders are not fatal
+        self.watches[wd] = folder
+        return True
+    
+    def note_change(self, folder):
+        now = time.monotonic()
+        if not self.changed:
+            self.first_change = now
+        self.last_change = now
+        self.changed.add(folder)
+    
+    def run(self):
+        next_poll = time.monotonic() + WATCH_POLL_INTERVAL
+        while not self.stop_event.is_set():
+            if self.inotify_fd is not None:
+                self.read_events(timeout=0.5)
+            else:
+                self.stop_event.wait(0.5)
+                if time.monotonic() >= next_poll:
+                    self.poll_mtimes()
+                    next_poll = time.monotonic() + WATCH_POLL_INTERVAL
+            
+            now = time.monotonic()
+            if self.changed and (now - self.last_change >= WATCH_DEBOUNCE or
+                                 now - self.first_change >= WATCH_MAX_DELAY):
+                folders, self.changed = self.changed, set()
+                try:
+                    added, removed = self.refresh(folders)
+                except Exception as e:
+                    print(f"Error refreshing folders: {e}")
+                    continue
+                if added or removed:
+                    self.on_change(added, removed)
+        if self.inotify_fd is not None:
+            os.close(self.inotify_fd)
+    
+    def read_events(self, timeout):
+        readable, _, _ = select.select([self.inotify_fd], [], [], timeout)
+        if not readable:
+            return
+        try:
+            data = os.read(self.inotify_fd, 65536)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_len = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size + name_len
+            if mask & self.IN_Q_OVERFLOW:
+                # Events were lost: fall back to checking every folder's mtime
+                self.poll_mtimes()
+                continue
+            folder = self.watches.get(wd)
+            if folder is None:
+                continue
+            if mask & self.IN_IGNORED:
+                del self.watches[wd]
+            # The folder's own deletion shows up as a change of its parent
+            if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+                folder = os.path.dirname(folder)
+            self.note_change(folder)
+    
+    def poll_mtimes(self):
+        for folder, mtime in list(self.mtimes.items()):
+            if self.stop_event.is_set():
+                return
+            try:
+                changed = os.stat(folder).st_mtime_ns != mtime
+            except OSError:
+                changed = True
+            if changed:
+                self.note_change(folder)
+    
+    def refresh(self, folders):
+        """Re-list changed folders and return the (added, removed) image paths"""
+        added, removed = [], []
+        for folder in folders:
+            old = self.index.dirs.get(folder)
+            if old is None:
+                continue  # Not indexed (yet), e.g. the parent of a root
+            try:
+                entry, _ = self.index.scan_dir(folder, rebuild=True)
+            except OSError:
+                self.forget(folder, removed)
+                continue
+            old_files = set(old["files"])
+            new_files = set(entry["files"])
+            added.extend(os.path.join(folder, name) for name in new_files - old_files)
+            removed.extend(os.path.join(folder, name) for name in old_files - new_files)
+            for sub in set(old["subdirs"]) - set(entry["subdirs"]):
+                self.forget(os.path.join(folder, sub), removed)
+            self.index.dirs[folder] = entry
+            self.mtimes[folder] = entry["mtime"]
+            for sub in set(entry["subdirs"]) - set(old["subdirs"]):
+                self.learn(os.path.join(folder, sub), added)
+        return added, removed
+    
+    def learn(self, folder, added):
+        """Index a new folder tree and collect its images"""
+        if folder in self.index.dirs:
+            return
+        try:
+            entry, _ = self.index.scan_dir(folder, rebuild=True)
+        except OSError:
+            return
+        self.index.dirs[folder] = entry
+        self.mtimes[folder] = entry["mtime"]
+        if self.inotify_fd is not None:
+            self.add_watch(folder)
+        added.extend(os.path.join(folder, name) for name in entry["files"])
+        for sub in entry["subdirs"]:
+            self.learn(os.path.join(folder, sub), added)
+    
+    def forget(self, folder, removed):
+        """Drop a vanished folder tree from the index and collect its images"""
+        entry = self.index.dirs.pop(folder, None)
+        self.mtimes.pop(folder, None)
+        if entry is None:
+            return
+        removed.extend(os.path.join(folder, name) for name in entry["files"])
+        for sub in entry["subdirs"]:
+            self.forget(os.path.join(folder, sub), removed)
+
+class DeleteQueue:
+    """Background thread removing the files of deleted images once their undo window has passed
+    
+    add() only queues the file; every DELETE_UNDO_MS-old deletion is then
+    removed in one batch, and undo() takes a deletion back until that batch
+    starts. Files that could not be removed are put on self.failed as
+    (path, error) for the UI to pick up; a file that is already gone counts
+    as removed.
+    """
+    def __init__(self, delay=DELETE_UNDO_MS / 1000, stats=None):
+        self.delay = delay
+        self.stats = stats
+        self.pending = OrderedDict()  # path -> time.monotonic() when it is removed
+        self.removing = 0  # files taken out of pending and not removed yet
+        self.failed = queue.Queue()
+        self.cond = threading.Condition()
+        self.closing = False
+        self.thread = None
+    
+    def add(self, path):
+        with self.cond:
+            self.pending[path] = time.monotonic() + self.delay
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            self.cond.notify()
+    
+    def undo(self, path):
+        """Keep a queued file; False if it is already being removed"""
+        with self.cond:
+            return self.pending.pop(path, None) is not None
+    
+    def undo_all(self):
+        """Keep every queued file whose removal has not started, and return their paths"""
+        with self.cond:
+            paths = list(self.pending)
+            self.pending.clear()
+            return paths
+    
+    def busy(self):
+        """Whether files are waiting to be removed, or failures to be picked up"""
+        with self.cond:
+            return bool(self.pending or self.removing) or not self.failed.empty()
+    
+    def run(self):
+        while True:
+            with self.cond:
+                while True:
+                    now = time.monotonic()
+                    due = [path for path, at in self.pending.items() if at <= now or self.closing]
+                    if due or (self.closing and not self.pending):
+                        break
+                    self.cond.wait(min(self.pending.values()) - now if self.pending else None)
+                for path in due:
+                    del self.pending[path]
+                self.removing = len(due)
+            if not due:
+                return
+            for path in due:
+                start = time.perf_counter()
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass  # Already removed by something else, which is what was asked for
+                except OSError as e:
+                    self.failed.put((path, e))
+                if self.stats:
+                    self.stats.record("delete", time.perf_counter() - start)
+                with self.cond:
+                    self.removing -= 1
+                    self.cond.notify_all()
+    
+    def close(self, timeout=READ_TIMEOUT):
+        """Remove every queued file now, waiting up to timeout seconds for them to be gone"""
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+            thread = self.thread
+        if thread:
+            thread.join(timeout)
+
+class Playlist:
+    """Compact, lazily shuffled list of image paths
+    
+    Paths are split into a table of folders and the file names, which are kept
+    as UTF-8 in one contiguous buffer with an offset array. The play order is a
+    seeded Feistel permutation of the entries, computed per position instead of
+    stored. Images added later are inserted at random upcoming positions (an
+    inside-out Fisher-Yates step) through a small dict of overridden positions.
+    Removed images leave a dead position that navigation skips. Dead entries
+    are compacted away, and the order reshuffled, each time the playlist wraps.
+    """
+    MIX = 0x9E3779B97F4A7C15
+    
+    def __init__(self, roots=(), seed=None):
+        self.rng = random.Random(seed)
+        # A single folder gets plain relative captions, several are prefixed with the root's name
+        self.root_captions = not isinstance(roots, str)
+        self.roots = [roots] if isinstance(roots, str) else list(roots)
+        self.dirs = []  # folder table
+        self.dir_ids = {}  # folder -> index in self.dirs
+        self.dir_roots = array('i')  # owning root's index in self.roots, or -1
+        self.dir_relative = []  # folder relative to its root, with a trailing separator
+        self.dir_captions = []  # caption prefix shown for the folder's images
+        self.dir_entries = {}  # folder index -> array of its entry ids
+        self.dir_names = {}  # folder index -> {UTF-8 name: live entry id}, built on the first lookup
+        self.clear()
+    
+    def clear(self):
+        self.names = bytearray()
+        self.offsets = array('I', [0])
+        self.entry_dirs = array('I')
+        self.alive = bytearray()
+        self.alive_count = 0
+        self.dir_entries.clear()
+        self.dir_names.clear()
+        self.size = 0  # positions in the current round, including dead ones
+        self.overrides = {}  # position -> entry id, where it differs from the permutation
+        self.reseed(0)
+    
+    def reseed(self, base_size):
+        """Start a new permutation of the first base_size entries"""
+        self.base_size = base_size
+        bits = max(2, (base_size - 1).bit_length())
+        self.half_bits = (bits + 1) // 2
+        self.keys = [self.rng.getrandbits(64) for _ in range(4)]
+    
+    def __len__(self):
+        return self.size
+    
+    def __bool__(self):
+        return self.alive_count > 0
+    
+    def folder_root(self, folder):
+        """The configured root a folder belongs to, or None"""
+        for root in self.roots:
+            try:
+                rel_path = os.path.relpath(folder, root)
+            except ValueError:
+                continue
+            if not rel_path.startswith('..'):
+                return root
+        return None
+    
+    def add_folder(self, folder, root=None):
+        """Register a folder with its root and caption prefix, and return its id"""
+        if root is None:
+            root = self.folder_root(folder)
+        if root is None:
+            rel_path = caption = os.path.join(folder, '')
+        else:
+            rel_path = os.path.relpath(folder, root)
+            rel_path = '' if rel_path == '.' else os.path.join(rel_path, '')
+            caption = f"{os.path.basename(root)} / {rel_path}" if self.root_captions else rel_path
+        dir_id = self.dir_ids[folder] = len(self.dirs)
+        self.dirs.append(folder)
+        self.dir_roots.append(self.roots.index(root) if root is not None else -1)
+        self.dir_relative.append(rel_path)
+        self.dir_captions.append(caption.replace("\\", " / "))  # For nicer display on Windows
+        return dir_id
+    
+    def add(self, path, root=None):
+        """Store a path and return its entry id"""
+        folder, name = os.path.split(path)
+        dir_id = self.dir_ids.get(folder)
+        if dir_id is None:
+            dir_id = self.add_folder(folder, root)
+        entry = len(self.entry_dirs)
+        self.names += name.encode("utf-8", "surrogateescape")
+        self.offsets.append(len(self.names))
+        self.entry_dirs.append(dir_id)
+        self.alive.append(1)
+        self.alive_count += 1
+        self.dir_entries.setdefault(dir_id, array('I')).append(entry)
+        names = self.dir_names.get(dir_id)
+        if names is not None:
+            names[bytes(self.names[self.offsets[entry]:])] = entry
+        return entry
+    
+    def name(self, entry):
+        return self.names[self.offsets[entry]:self.offsets[entry + 1]].decode("utf-8", "surrogateescape")
+    
+    def path(self, entry):
+        return os.path.join(self.dirs[self.entry_dirs[entry]], self.name(entry))
+    
+    def caption(self, pos):
+        """Text shown under the image at a position"""
+        entry = self.entry_at(pos)
+        return self.dir_captions[self.entry_dirs[entry]] + self.name(entry)
+    
+    def relative_path(self, pos):
+        """Path of the image at a position relative to its root folder"""
+        entry = self.entry_at(pos)
+        return self.dir_relative[self.entry_dirs[entry]] + self.name(entry)
+    
+    def root_of(self, pos):
+        """Index in roots of the folder the image at a position was found in, or -1"""
+        return self.dir_roots[self.entry_dirs[self.entry_at(pos)]]
+    
+    def find(self, path):
+        """Entry id of a live path, or None"""
+        folder, name = os.path.split(path)
+        dir_id = self.dir_ids.get(folder)
+        if dir_id is None:
+            return None
+        names = self.dir_names.get(dir_id)
+        if names is None:
+            names = self.dir_names[dir_id] = self.folder_names(dir_id)
+        return names.get(name.encode("utf-8", "surrogateescape"))
+    
+    def folder_names(self, dir_id):
+        """Map the UTF-8 names of a folder's live entries to their entry ids"""
+        view = memoryview(self.names)
+        offsets = self.offsets
+        alive = self.alive
+        names = {view[offsets[e]:offsets[e + 1]].tobytes(): e
+                 for e in self.dir_entries.get(dir_id, ()) if alive[e]}
+        view.release()
+        return names
+    
+    def forget(self, entry):
+        """Mark an entry dead and drop it from its folder's name lookup"""
+        self.alive[entry] = 0
+        self.alive_count -= 1
+        names = self.dir_names.get(self.entry_dirs[entry])
+        if names is not None:
+            raw = bytes(self.names[self.offsets[entry]:self.offsets[entry + 1]])
+            if names.get(raw) == entry:
+                del names[raw]
+    
+    def mix(self, value, key, mask):
+        f = ((value ^ key) * self.MIX) & 0xFFFFFFFFFFFFFFFF
+        return (f ^ (f >> 31)) & mask
+    
+    def permute(self, i):
+        """Map a position below base_size to an entry id (cycle-walking Feistel network)"""
+        half = self.half_bits
+        mask = (1 << half) - 1
+        while True:
+            left, right = i >> half, i & mask
+            for key in self.keys:
+                left, right = right, left ^ self.mix(right, key, mask)
+            i = (left << half) | right
+            if i < self.base_size:
+                return i
+    
+    def unpermute(self, entry):
+        """Inverse of permute: the position an entry id has in the base order"""
+        half = self.half_bits
+        mask = (1 << half) - 1
+        while True:
+            left, right = entry >> half, entry & mask
+            for key in reversed(self.keys):
+                left, right = right ^ self.mix(left, key, mask), left
+            entry = (left << half) | right
+            if entry < self.base_size:
+                return entry
+    
+    def entry_at(self, pos):
+        entry = self.overrides.get(pos)
+        return self.permute(pos) if entry is None else entry
+    
+    def __getitem__(self, pos):
+        return self.path(self.entry_at(pos))
+    
+    def is_alive(self, pos):
+        return 0 <= pos < self.size and self.alive[self.entry_at(pos)]
+    
+    def step(self, pos, delta):
+        """Nearest live position in the direction of delta, wrapping around"""
+        if not self.alive_count:
+            return 0
+        pos = (pos + delta) % self.size
+        while not self.alive[self.entry_at(pos)]:
+            pos = (pos + delta) % self.size
+        return pos
+    
+    def seek(self, pos):
+        """pos itself if it holds a live image, otherwise the next live position"""
+        return pos if self.is_alive(pos) else self.step(pos, 1)
+    
+    def advance(self, pos):
+        """Position after pos, starting a freshly shuffled round after the last one
+        
+        A new round holds the image at pos at position 0, so the slide just
+        shown stays right before the returned position.
+        """
+        following = self.step(pos, 1)
+        if following <= pos:
+            last = self[pos] if self.is_alive(pos) else None
+            self.reshuffle()
+            entry = self.find(last) if last else None
+            if entry is None:
+                return self.seek(0)
+            j = self.unpermute(entry)
+            if j:
+                self.overrides[j] = self.entry_at(0)
+                self.overrides[0] = entry
+            return self.step(0, 1)
+        return following
+    
+    def insert_random(self, path, lo, root=None):
+        """Add a path at a uniformly random position in [lo, len]"""
+        self.insert_at(path, self.rng.randint(lo, self.size), root, keep=lo)
+    
+    def insert_at(self, path, j, root=None, keep=None):
+        """Add a path at position j; a rebuild of the order keeps the positions below keep (default j + 1)"""
+        entry = self.add(path, root)
+        # The entry at j moves to the end and the new one takes its place
+        self.overrides[self.size] = self.entry_at(j) if j < self.size else entry
+        self.overrides[j] = entry
+        self.size += 1
+        if len(self.overrides) > max(PLAYLIST_MAX_OVERRIDES, self.base_size // 8):
+            self.rebase(j + 1 if keep is None else keep)
+    
+    def discard_at(self, pos):
+        """Hide the image at a position; the position itself stays, and is skipped"""
+        entry = self.entry_at(pos)
+        if self.alive[entry]:
+            self.forget(entry)
+    
+    def discard(self, path):
+        entry = self.find(path)
+        if entry is None:
+            return False
+        self.forget(entry)
+        return True
+    
+    def rebase(self, keep):
+        """Fold the overrides into a new permutation, keeping the positions below keep"""
+        kept = [self.entry_at(pos) for pos in range(keep)]
+        self.size = len(self.alive)
+        self.reseed(self.size)
+        self.overrides = dict(enumerate(kept))
+        # Entries the new permutation would put below keep, but that keep displaced
+        kept_set = set(kept)
+        spare = [e for e in map(self.permute, range(keep)) if e not in kept_set]
+        # Kept entries the new permutation shows again later get those instead
+        for entry in kept:
+            pos = self.unpermute(entry)
+            if pos >= keep:
+                self.overrides[pos] = spare.pop()
+    
+    def reshuffle(self):
+        """Drop dead entries and start a new random order"""
+        if self.alive_count < len(self.alive):
+            paths = [(self.path(e), self.dir_roots[self.entry_dirs[e]])
+                     for e in range(len(self.alive)) if self.alive[e]]
+            self.clear()
+            for path, root in paths:
+                self.add(path, self.roots[root] if root >= 0 else None)
+        self.rebase(0)
 
 class ImageViewer:
-    def __init__(self, folder_path, screensaver_mode=False):
+    def __init__(self, folder_path, screensaver_mode=False, prefetch_depth=PREFETCH_DEPTH,
+                 rebuild_index=False, watch_folders=WATCH_FOLDERS, collect_stats=STATS_ENABLED,
+                 progressive=PROGRESSIVE_RENDER, decode_processes=DECODE_PROCESSES):
+        self.start_time = time.perf_counter()
+        self.time_to_first_image = None
+        # Timing instrumentation; every hook checks for None first, so it costs nothing when off
+        self.stats = FrameStats() if collect_stats else None
+        self.stats_overlay = None
         self.root = Tk()
         self.screensaver_mode = screensaver_mode
         
@@ -41,30 +2002,120 @@ class ImageViewer:
         self.canvas.focus_force()
         
         # Image handling
-        self.current_image = None
-        self.image_files = self.get_image_files(folder_path)
+        self.rebuild_index = rebuild_index
+        self.image_files = Playlist(folder_path)
+        self.root_scan_times = {}
+        self.file_index = None
+        self.watch_folders = watch_folders
+        self.watcher = None
+        self.probe = None
         self.current_index = 0
         self.folder_path = folder_path
         
-        # Add text for file info
-        self.info_text = None
-          # Timer ID for slideshow
+        # One screen-sized photo and caption stay on the canvas; slides are pasted into the photo.
+        # Frames are letterboxed into one of two screen buffers first: the front one holds the
+        # slide on screen, the back one the next slide, prepared ahead of its deadline.
+        self.photo = ImageTk.PhotoImage("RGB", (self.screen_w, self.screen_h))
+        self.screen_buffers = [Image.new("RGB", (self.screen_w, self.screen_h)) for _ in range(2)]
+        self.buffer_boxes = [None, None]  # Area of each buffer covered by its frame
+        self.front = 0
+        self.image_item = self.canvas.create_image(
+            self.screen_w // 2, 
+            self.screen_h // 2, 
+            image=self.photo, 
+            anchor="center"
+        )
+        self.info_text = self.canvas.create_text(
+            10, self.screen_h - 10,  # Position in bottom-left corner
+            text="",
+            fill="white",
+            anchor="sw",  # Southwest alignment
+            font=("Arial", 12)
+        )
+        # Deletion and undo messages, above the caption
+        self.notice_text = self.canvas.create_text(
+            10, self.screen_h - 32, text="", fill="yellow", anchor="sw", font=("Arial", 12))
+        self.notice_after = None
+        # Timer ID for slideshow
         self.after_id = None
         
-        # Slideshow state
+        # Slideshow state: the next slide is due at self.deadline (time.monotonic)
         self.slideshow_paused = False
+        self.deadline = None
+        self.prepared = None  # (path, frame) letterboxed into the back buffer ahead of the deadline
+        self.displayed = None  # (position, path) of the slide on screen
+        # Arrow key navigation waiting for its target to be decoded
+        self.nav_pending = False
+        self.nav_future = None  # Decode the pending navigation waits for
+        self.placeholder = None  # (path, frame or None) shown while it waits
+        self.slides_shown = 0
+        self.missed_deadlines = 0
+        
+        # Background decoding of upcoming slides, keyed by path
+        self.prefetch_depth = prefetch_depth
+        self.executor = ThreadPoolExecutor(max_workers=max(DECODE_WORKERS, decode_processes))
+        self.decoder = None
+        if decode_processes:
+            try:
+                self.decoder = ProcessDecoder(decode_processes, self.screen_w, self.screen_h)
+            except Exception as e:
+                print(f"Error starting decode processes, decoding in-process: {e}")
+        self.prefetched = {}
+        self.frame_cache = FrameCache()
+        self.quarantine = Quarantine()
+        self.failures = 0  # Images in a row that failed to load
+        self.disk_cache = DiskCache()
+        self.peak_decode_bytes = 0
+        
+        # Files are read on threads of their own root, with a timeout, so a hung share cannot freeze Tk;
+        # roots that timed out are passed over until their penalty expires, by index into the roots
+        self.read_ahead = ReadAhead(self.image_files.roots)
+        self.slow_roots = {}  # root index -> time.monotonic() until which it is passed over
+        self.read_timeouts = 0
+        
+        # Deleted images are hidden at once; their files are removed in the background after the undo window
+        self.deleter = DeleteQueue(stats=self.stats)
+        self.deleted = []  # (path, root) of the deletions Ctrl+Z can take back, latest last
+        self.after_delete_poll = None
+        
+        # Quick previews get their own worker so they are not queued behind full decodes
+        self.progressive = progressive
+        self.preview_executor = ThreadPoolExecutor(max_workers=1)
+        self.preview = None  # (path, future) of the latest preview requested
+        self.slide_token = 0  # Bumped for every slide shown, so stale refinements can be told apart
+        
+        # Frames of the animated slide on screen are decoded on a worker of their own
+        self.animation_executor = ThreadPoolExecutor(max_workers=1)
+        self.animation = None
         
         # Bind events
-        self.root.bind("<Escape>", lambda e: self.root.destroy())
+        self.root.bind("<Escape>", lambda e: self.close())
         self.root.bind("<Left>", self.previous_image)
         self.root.bind("<Right>", self.next_image)
         self.root.bind("<Delete>", self.delete_current_image)
+        self.root.bind("<Control-z>", self.undo_delete)
         self.root.bind("<space>", self.toggle_slideshow)  # Pause/resume with spacebar
-        if self.image_files:
-            self.update_image()
-            # Final focus attempt after everything is set up
-            self.root.after(300, self._ensure_focus)
-            self.root.mainloop()
+        if self.stats:
+            self.root.bind("<F3>", self.toggle_stats_overlay)
+            self.root.after(STATS_EXPORT_MS, self.export_stats)
+        
+        # The discovery thread first checks the slides the last session was about to show, so they
+        # start the slideshow while the folders are scanned
+        self.snapshot_slides = None
+        self.snapshot_paths = set()
+        self.snapshot_end = 0  # Positions before this hold the snapshot's slides, until they are reached
+        
+        # Discover images in the background and start the slideshow with the first ones found
+        self.slideshow_started = False
+        self.discovery_finished = False
+        self.discovered = queue.Queue()
+        self.discovery_stop = threading.Event()
+        threading.Thread(target=self.discover, daemon=True).start()
+        self.root.after(0, self.drain_discovery)
+        
+        # Final focus attempt after everything is set up
+        self.root.after(300, self._ensure_focus)
+        self.root.mainloop()
     
     def _ensure_focus(self):
         """Ensure the window has focus after initialization"""
@@ -72,199 +2123,838 @@ class ImageViewer:
         self.root.lift()
         self.canvas.focus_set()
         
+    def close(self):
+        """Stop background decoding and close the window"""
+        self.discovery_stop.set()
+        if self.watcher:
+            self.watcher.stop()
+        if self.probe:
+            self.probe.stop()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.preview_executor.shutdown(wait=False, cancel_futures=True)
+        self.stop_animation()
+        self.animation_executor.shutdown(wait=False, cancel_futures=True)
+        if self.decoder:
+            self.decoder.close()
+        self.disk_cache.close()
+        ARCHIVES.close()
+        self.quarantine.save()
+        self.prefetched.clear()
+        if self.stats:
+            self.stats.export()
+        if self.slides_shown:
+            print(f"Missed {self.missed_deadlines} of {self.slides_shown} slide deadlines")
+        if self.peak_decode_bytes:
+            print(f"Peak decode memory per slide: {self.peak_decode_bytes / (1024 * 1024):.1f} MB")
+        stalls = self.read_ahead.report()
+        if stalls:
+            print(f"Slow file reads, {self.read_timeouts} slides skipped after a timeout:")
+            for line in stalls:
+                print(f"  {line}")
+        self.root.destroy()
+        self.save_snapshot()
+        # Escape in manual mode carries out the deletions still in their undo window. A screensaver
+        # ends on any mouse movement, which says nothing about them, so there they are taken back
+        if self.screensaver_mode:
+            kept = self.deleter.undo_all()
+            if kept:
+                print(f"Kept {len(kept)} images whose deletion was still in its undo window")
+        self.deleter.close()
+        while not self.deleter.failed.empty():
+            path, error = self.deleter.failed.get()
+            print(f"Error deleting image: {error}")
+    
+    def snapshot_folders(self):
+        return [self.folder_path] if isinstance(self.folder_path, str) else list(self.folder_path)
+    
+    def save_snapshot(self):
+        """Remember the upcoming slides for a quick start next time
+        
+        The scaled frames of the first SNAPSHOT_FRAMES are written to the render
+        cache now if they are not there yet; the rest are decoded as usual.
+        """
+        slides = []
+        start = index = self.image_files.seek(self.current_index) if self.image_files else None
+        # At most one pass, and a short one, so exit does not wait on files that cannot be read
+        tried = 0
+        now = time.monotonic()
+        skipped_roots = {root for root, until in self.slow_roots.items() if until > now}
+        while index is not None and len(slides) < SNAPSHOT_SLIDES and tried < SNAPSHOT_SLIDES * 4:
+            if tried and index == start:
+                break  # Fewer images than the snapshot holds
+            tried += 1
+            path = self.image_files[index]
+            root = self.image_files.root_of(index)
+            index = self.image_files.step(index, 1)
+            if root in skipped_roots:
+                continue
+            try:
+                st = self.read_ahead.stat(path)
+            except TimeoutError:
+                skipped_roots.add(root)  # Do not wait for the same root again on the way out
+                continue
+            except OSError:
+                continue
+            if len(slides) < SNAPSHOT_FRAMES:
+                key = DiskCache.key(path, st, self.screen_w, self.screen_h)
+                img = self.frame_cache.get((path, st.st_mtime, self.screen_w, self.screen_h))
+                if img is not None and key not in self.disk_cache:
+                    self.disk_cache.put(key, img, wait=True)
+            slides.append([path, self.image_files.roots[root] if root >= 0 else None,
+                           st.st_size, st.st_mtime_ns])
+        
+        path = app_file(".snapshot")
+        try:
+            with open(path + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump({"folders": self.snapshot_folders(), "screen": [self.screen_w, self.screen_h],
+                           "slides": slides}, f)
+            os.replace(path + ".tmp", path)
+        except Exception as e:
+            print(f"Error saving snapshot: {e}")
+    
+    def restore_snapshot(self):
+        """Return [path, root] of the slides saved by save_snapshot that are still valid
+        
+        The snapshot is only used with the same folders and screen size, and
+        only for files whose size and mtime have not changed. Runs on the
+        discovery thread, since the files may be on a slow share.
+        """
+        try:
+            with open(app_file(".snapshot"), 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return []
+        except Exception as e:
+            print(f"Error loading snapshot: {e}")
+            return []
+        if (snapshot.get("folders") != self.snapshot_folders()
+                or snapshot.get("screen") != [self.screen_w, self.screen_h]):
+            return []
+        
+        saved = snapshot.get("slides", ())
+        slides = []
+        for (path, root, size, mtime_ns), st in zip(saved, self.read_ahead.stat_all([slide[0] for slide in saved])):
+            if st is None:
+                continue
+            if ((st.st_size, st.st_mtime_ns) != (size, mtime_ns) or [path, root] in slides
+                    or self.quarantine.blocks(path)):
+                continue
+            slides.append([path, root])
+        return slides
+    
+    def queue_snapshot(self, slides):
+        """Queue the slides restore_snapshot found, in their saved order"""
+        for path, root in slides:
+            if path not in self.snapshot_paths:
+                self.image_files.insert_random(path, len(self.image_files), root)
+                self.snapshot_paths.add(path)
+        self.snapshot_end = self.image_files.size
+        
     def exit_screensaver(self, event=None):
         """Exit screensaver mode"""
         if self.screensaver_mode:
-            self.root.destroy()
+            self.close()
+    
     def get_image_files(self, folders):
-        supported_exts = ['.png', '.jpg', '.jpeg', '.jpe', '.bmp', '.gif', '.tiff', '.tif', '.webp', '.heic']
-        files = []
+        """Scan folders and return every image in random order"""
+        files = [path for _, batch in self.iter_image_files(folders) for path in batch]
+        random.shuffle(files)
+        return files
+    
+    def iter_image_files(self, folders):
+        """Yield (root, paths) batches of images as they are found"""
         # Handle both single folder and list of folders
         if isinstance(folders, str):
             folders = [folders]
         
-        for folder in folders:
-            for root, _, filenames in os.walk(folder):
-                for f in filenames:
-                    if os.path.splitext(f.lower())[1] in supported_exts:
-                        files.append(os.path.join(root, f))
-        random.shuffle(files)
-        return files
+        scan_start = time.perf_counter()
+        index = self.file_index = FileIndex()
+        yield from index.iter_scan(folders, rebuild=self.rebuild_index)
+        self.root_scan_times = index.root_times
+        if getattr(self, "stats", None):
+            self.stats.record("discovery", time.perf_counter() - scan_start)
+        print(f"Found {index.stats['files']} images in {time.perf_counter() - scan_start:.2f}s, "
+              f"rescanned {index.stats['rescanned']} of {index.stats['dirs']} folders")
+        for root, seconds in sorted(index.root_times.items(), key=lambda item: -item[1]):
+            print(f"  {seconds:.2f}s  {root}")
+    
+    def discover(self):
+        """Producer thread: feed (root, added, removed) batches to the UI, with a None marker once the scan is done"""
+        # Set before the first batch is queued, so drain_discovery sees it first
+        self.snapshot_slides = self.restore_snapshot()
+        try:
+            for root, batch in self.iter_image_files(self.folder_path):
+                if self.discovery_stop.is_set():
+                    return
+                batch = [path for path in batch if not self.quarantine.blocks(path)]
+                self.discovered.put((root, batch, ()))
+        except Exception as e:
+            print(f"Error scanning folders: {e}")
+        self.discovered.put(None)
+        
+        if not self.file_index or self.discovery_stop.is_set():
+            return
+        
+        # Check image headers in the background and drop files that cannot be shown
+        self.probe = MetadataProbe(
+            self.file_index, self.quarantine, lambda bad: self.discovered.put((None, (), bad)))
+        self.probe.start()
+        
+        # Keep following the folders for the rest of the session
+        if self.watch_folders:
+            self.watcher = FolderWatcher(self.file_index, self.folders_changed)
+            self.watcher.start()
+    
+    def folders_changed(self, added, removed):
+        """Watcher callback: update the playlist and probe the new images"""
+        added = [path for path in added if not self.quarantine.blocks(path)]
+        self.discovered.put((None, added, removed))
+        if added:
+            self.probe.add(added)
+    
+    def add_image_files(self, paths, root=None):
+        """Insert new images at random positions among the slides not yet shown
+        
+        This is an inside-out Fisher-Yates shuffle of the upcoming part of the
+        playlist, so it stays uniformly shuffled however it grows.
+        """
+        # The snapshot's slides come first, even when the first images found arrive before the slideshow starts
+        if self.current_index >= self.snapshot_end:
+            self.snapshot_end = 0
+        lo = max(self.current_index, self.snapshot_end)
+        for path in paths:
+            if path in self.snapshot_paths:
+                self.snapshot_paths.discard(path)  # Already queued from the snapshot
+                continue
+            self.image_files.insert_random(path, lo, root)
+    
+    def remove_image_files(self, paths):
+        """Drop images that disappeared from disk, keeping the current position"""
+        for path in paths:
+            if self.image_files.discard(path):
+                future = self.prefetched.pop(path, None)
+                if future:
+                    future.cancel()
+                    self.read_ahead.drop(path)
+                self.frame_cache.invalidate(path)
+        
+        if not self.image_files:
+            # Nothing left to show; start over when images come back
+            self.image_files.reshuffle()
+            self.current_index = 0
+            self.slideshow_started = False
+            self.cancel_slide()
+            self.slide_token += 1
+            self.stop_animation()
+            self.prepared = None
+            self.displayed = None
+            for i in range(2):
+                self.compose(i, None)
+            self.photo.paste(self.screen_buffers[self.front])
+            self.canvas.itemconfig(self.info_text, text="")
+    
+    def drain_discovery(self):
+        """Apply discovered and watched changes to the playlist and start the slideshow once there is an image"""
+        finished = False
+        if self.snapshot_slides:
+            self.queue_snapshot(self.snapshot_slides)
+            self.snapshot_slides = None
+        try:
+            while True:
+                change = self.discovered.get_nowait()
+                if change is None:
+                    finished = self.discovery_finished = True
+                    continue
+                root, added, removed = change
+                if removed:
+                    self.remove_image_files(removed)
+                if added:
+                    self.add_image_files(added, root)
+        except queue.Empty:
+            pass
+        
+        if self.image_files and not self.slideshow_started:
+            self.slideshow_started = True
+            self.update_image()
+        
+        if finished and not self.image_files:
+            print("No images found.")
+            self.close()
+        elif not self.discovery_finished:
+            self.root.after(DISCOVERY_POLL_MS, self.drain_discovery)
+        elif self.watch_folders:
+            self.root.after(WATCH_DRAIN_MS, self.drain_discovery)
     
     def previous_image(self, event=None):
-        if self.after_id:
-            self.root.after_cancel(self.after_id)
-        self.current_index = (self.current_index - 2) % len(self.image_files)
-        self.update_image(manual=True)
+        self.navigate(-1)
 
     def next_image(self, event=None):
-        if self.after_id:
-            self.root.after_cancel(self.after_id)
+        self.navigate(1)
+    
+    def navigate(self, delta):
+        """Move delta slides away, coalescing key repeats while the target is still being decoded
+        
+        While a render is pending, further presses only move its target and
+        show a placeholder; the render picks up the latest target when it is done.
+        """
+        if not self.image_files:
+            return
+        if self.nav_pending:
+            self.current_index = self.image_files.step(self.current_index, delta)
+            self.show_placeholder(self.current_index)
+            return
+        self.cancel_slide()
+        # current_index is already one past the slide on screen
+        if delta != 1:
+            displayed_index = self.displayed_index()
+            if displayed_index is None:
+                displayed_index = self.image_files.step(self.current_index, -1)
+            self.current_index = self.image_files.step(displayed_index, delta)
+        self.nav_pending = True
         self.update_image(manual=True)
+    
+    def displayed_index(self):
+        """Playlist position of the slide on screen, or None if the playlist changed under it"""
+        if self.displayed is None:
+            return None
+        pos, path = self.displayed
+        if pos < len(self.image_files) and self.image_files[pos] == path:
+            return pos
+        return None
+    
+    def show_placeholder(self, index):
+        """Show the cached frame or quick preview of the slide at index if there is one, and its caption"""
+        self.stop_animation()
+        path = self.image_files[index]
+        shown_path, shown_img = self.placeholder or (None, None)
+        if shown_path != path:
+            self.canvas.itemconfig(self.info_text, text=self.image_files.caption(index))
+            shown_img = None
+        img = self.frame_cache.latest(path)
+        if img is None:
+            img = self.preview_frame(path)
+        if img is not None and img is not shown_img:
+            self.compose(self.front, img)
+            self.photo.paste(self.screen_buffers[self.front])
+            shown_img = img
+        self.placeholder = (path, shown_img)
+
+    def is_cached(self, path, st):
+        """Whether a frame of the file with this stat is in the frame or render cache"""
+        return ((path, st.st_mtime, self.screen_w, self.screen_h) in self.frame_cache
+                or DiskCache.key(path, st, self.screen_w, self.screen_h) in self.disk_cache)
+    
+    def load_frame(self, path):
+        """Return the screen-sized frame for path, reading and decoding it only on a cache miss
+        
+        Raises TimeoutError if the file cannot be read within READ_TIMEOUT.
+        """
+        start = time.perf_counter()
+        st, data = self.read_ahead.read(path, self.is_cached)
+        read_s = time.perf_counter() - start
+        key = (path, st.st_mtime, self.screen_w, self.screen_h)
+        img = self.frame_cache.get(key)
+        if img is None:
+            disk_key = DiskCache.key(path, st, self.screen_w, self.screen_h)
+            start = time.perf_counter()
+            img = self.disk_cache.get(disk_key)
+            if img is not None and self.stats:
+                self.stats.record("disk_cache", time.perf_counter() - start)
+            if img is None:
+                # Use the probed orientation when there is one, saving an EXIF parse
+                meta = self.file_index.metadata(path, st) if self.file_index else None
+                orientation = meta[3] if meta and len(meta) == 5 else None
+                if data is None:
+                    # Read ahead found the frame cached, but it has been evicted since
+                    start = time.perf_counter()
+                    st, data = self.read_ahead.read(path)
+                    read_s += time.perf_counter() - start
+                timings = {"read": read_s} if self.stats else None
+                try:
+                    if self.decoder:
+                        img = self.decoder.decode(data, orientation, timings)
+                    else:
+                        img = load_scaled_image(data, self.screen_w, self.screen_h, orientation, timings)
+                except UnidentifiedImageError:
+                    # Decoded from memory, so Pillow's message names a BytesIO object instead of the file
+                    error = UnidentifiedImageError(f"cannot identify image file {path!r}")
+                    self.quarantine.record(path, st, error)
+                    raise error from None
+                except Exception as e:
+                    self.quarantine.record(path, st, e)
+                    raise
+                self.quarantine.release(path)
+                if self.stats:
+                    self.stats.record_all(timings)
+                self.disk_cache.put(disk_key, img)
+            self.frame_cache.put(key, img)
+        return img
 
+    def prefetch(self, start_index, keep_first=False):
+        """Queue reading and decoding of the next slides and cancel prefetches outside that window
+        
+        Slides from roots being passed over are left out, except the first
+        one with keep_first.
+        """
+        wanted = set()
+        index = self.image_files.seek(start_index)
+        if not keep_first:
+            index = self.skip_slow(index)
+        for _ in range(self.prefetch_depth + 1):
+            path = self.image_files[index]
+            if path in wanted:
+                break  # Fewer images than the prefetch window
+            wanted.add(path)
+            if path not in self.prefetched:
+                if self.frame_cache.latest(path) is None:
+                    self.read_ahead.fetch(path, self.is_cached)
+                self.prefetched[path] = self.executor.submit(self.load_frame, path)
+            index = self.skip_slow(self.image_files.step(index, 1))
+        
+        for path in list(self.prefetched):
+            if path not in wanted:
+                self.prefetched.pop(path).cancel()
+                self.read_ahead.drop(path)
+    
+    def skip_slow(self, index):
+        """First position from index on whose image is not on a root being passed over
+        
+        Gives up, returning index, after SLOW_ROOT_SKIP positions, so the
+        slideshow goes on with the slow roots when there is nothing else.
+        """
+        if not self.slow_roots:
+            return index
+        now = time.monotonic()
+        for root, until in list(self.slow_roots.items()):
+            if until <= now:
+                del self.slow_roots[root]
+        pos = index
+        for _ in range(SLOW_ROOT_SKIP if self.slow_roots else 0):
+            if self.image_files.root_of(pos) not in self.slow_roots:
+                return pos
+            pos = self.image_files.step(pos, 1)
+        return index
+
+    def toggle_stats_overlay(self, event=None):
+        """Show or hide the timing summary in the top-left corner (F3)"""
+        if self.stats_overlay:
+            self.canvas.delete(self.stats_overlay)
+            self.stats_overlay = None
+        else:
+            self.stats_overlay = self.canvas.create_text(
+                10, 10, text=self.stats.overlay_text(), fill="yellow", anchor="nw",
+                font=("Courier", 10))
+    
+    def export_stats(self):
+        self.stats.export()
+        self.root.after(STATS_EXPORT_MS, self.export_stats)
+    
+    def cancel_slide(self):
+        """Cancel the pending slideshow timer and forget the deadline"""
+        if self.after_id:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+        self.deadline = None
+        self.nav_pending = False
+        self.nav_future = None
+    
+    def schedule_slide(self, delay_ms=None, previous_deadline=None):
+        """Set the deadline of the next slide and prepare its frame ahead of it
+        
+        Without delay_ms the slideshow keeps its cadence: the next deadline is
+        the previous one plus SLIDE_INTERVAL_MS, whatever rendering took. A
+        slideshow that fell more than a whole slide behind starts over from now
+        rather than rushing through the backlog.
+        """
+        self.cancel_slide()
+        if self.slideshow_paused:
+            return
+        now = time.monotonic()
+        if delay_ms is None:
+            self.deadline = (previous_deadline or now) + SLIDE_INTERVAL_MS / 1000
+            if self.deadline < now:
+                self.deadline = now + SLIDE_INTERVAL_MS / 1000
+        else:
+            self.deadline = now + delay_ms / 1000
+        prepare_in = self.deadline - now - PREPARE_LEAD_MS / 1000
+        self.after_id = self.root.after(max(0, int(prepare_in * 1000)), self.prepare_slide)
+    
+    def prepare_slide(self):
+        """Convert the next frame for display shortly before its deadline, then wait for the deadline"""
+        self.after_id = None
+        if not self.image_files:
+            return
+        index = self.skip_slow(self.image_files.seek(self.current_index))
+        self.prefetch(index)
+        path = self.image_files[index]
+        future = self.prefetched.get(path)
+        if future and future.done() and not future.exception():
+            img = future.result()
+            self.compose(1 - self.front, img)
+            self.prepared = (path, img)
+        show_in = self.deadline - time.monotonic()
+        self.after_id = self.root.after(max(0, int(show_in * 1000)), self.update_image)
+    
+    def compose(self, buffer, img):
+        """Letterbox img into a screen buffer (0 or 1), blacking out what the previous frame left
+        
+        With img None the buffer is cleared.
+        """
+        screen = self.screen_buffers[buffer]
+        old_box = self.buffer_boxes[buffer]
+        box = None
+        if img is not None:
+            left = (self.screen_w - img.width) // 2
+            top = (self.screen_h - img.height) // 2
+            box = (left, top, left + img.width, top + img.height)
+        transparent = img is not None and (img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info)
+        if old_box and (old_box != box or transparent):
+            screen.paste(0, old_box)
+        if transparent:
+            img = img.convert("RGBA")
+            screen.paste(img, box, img)
+        elif img is not None:
+            screen.paste(img, box)
+        self.buffer_boxes[buffer] = box
+    
+    def preview_frame(self, path):
+        """Return a quick low-quality frame for path, or None until one is ready
+        
+        The first call for a path queues the preview and drops the one before it.
+        """
+        if not self.progressive:
+            return None
+        if self.preview is None or self.preview[0] != path:
+            if self.preview:
+                self.preview[1].cancel()
+            self.preview = (path, self.preview_executor.submit(
+                self.load_preview, path))
+            return None
+        future = self.preview[1]
+        if not future.done() or future.exception():
+            return None
+        return future.result()
+    
+    def read_file(self, path):
+        """Contents of an image file for a preview or an animation, through the timed reads of read_ahead"""
+        return self.read_ahead.read(path, share=True)[1]
+    
+    def load_preview(self, path):
+        return load_preview_image(self.read_file(path), self.screen_w, self.screen_h)
+    
+    def refine_slide(self, token, future, shown_at):
+        """Swap the full-quality frame in for the preview on screen once it is decoded
+        
+        Refinements of a slide that has been replaced since are dropped.
+        """
+        if token != self.slide_token:
+            future.cancel()
+            return
+        if not future.done():
+            self.root.after(FRAME_POLL_MS, self.refine_slide, token, future, shown_at)
+            return
+        if future.cancelled() or future.exception():
+            return  # Keep the preview; the failure was recorded by load_frame
+        img = future.result()
+        self.failures = 0
+        self.peak_decode_bytes = max(self.peak_decode_bytes, img.info.get("peak_bytes", 0))
+        self.compose(self.front, img)
+        self.photo.paste(self.screen_buffers[self.front])
+        if self.stats:
+            self.stats.record("refine", time.perf_counter() - shown_at)
+    
+    def start_animation(self, path):
+        """Play the slide just shown if it is an animation"""
+        self.stop_animation()
+        if os.path.splitext(path)[1].lower() not in ANIMATED_EXTS:
+            return
+        orientation = None
+        if self.file_index:
+            # The probe's result unchecked, since the file may be on a slow share
+            meta = self.file_index.metadata(path)
+            if meta and len(meta) == 5:
+                if meta[4] <= 1:
+                    return  # Probed as a still image
+                orientation = meta[3]
+        # Otherwise the first decode tells whether there is more than one frame
+        anim = self.animation = Animation(path, self.screen_w, self.screen_h, orientation, read=self.read_file)
+        anim.due = time.monotonic()
+        anim.future = self.animation_executor.submit(anim.load, 0)
+        self.root.after(FRAME_POLL_MS, self.animate, anim)
+    
+    def stop_animation(self):
+        if self.animation:
+            self.animation.close()
+            self.animation = None
+    
+    def animate(self, anim):
+        """Tk timer of the animation on screen: show its next frame once it is due and decoded
+        
+        Frame 0 is already on screen as the slide itself; its decode only
+        provides its duration and the frame count.
+        """
+        if anim is not self.animation:
+            return
+        if not anim.future.done():
+            self.root.after(FRAME_POLL_MS, self.animate, anim)
+            return
+        try:
+            result = anim.future.result()
+        except Exception as e:
+            print(f"Error playing animation: {e}")
+            result = None
+        if result is None or anim.n_frames <= 1:
+            self.stop_animation()
+            return
+        now = time.monotonic()
+        if now < anim.due:
+            self.root.after(max(1, int((anim.due - now) * 1000)), self.animate, anim)
+            return
+        
+        frame, duration = result
+        n = 0 if anim.shown is None else (anim.shown + 1) % anim.n_frames
+        if anim.shown is not None:
+            self.compose(self.front, frame)
+            self.photo.paste(self.screen_buffers[self.front])
+            if n == 0:
+                anim.loop_done = True
+        anim.shown = n
+        # Keep the native timing, unless decoding fell more than a frame behind
+        anim.due += duration / 1000
+        if anim.due < now:
+            anim.due = now + duration / 1000
+        anim.future = self.animation_executor.submit(anim.load, (n + 1) % anim.n_frames)
+        self.root.after(max(1, int((anim.due - now) * 1000)), self.animate, anim)
+    
     def update_image(self, manual=False):
+        started_at = time.perf_counter() if self.stats else None
         try:
-            # Load image and preserve EXIF orientation
-            img = Image.open(self.image_files[self.current_index])
-            
-            # Preserve EXIF orientation
-            try:
-                exif = img._getexif()
-                if exif and 274 in exif:  # 274 is the orientation tag
-                    orientation = exif[274]
-                    if orientation > 1:
-                        ORIENTATION_TRANSFORMS = {
-                            2: (Image.FLIP_LEFT_RIGHT,),
-                            3: (Image.ROTATE_180,),
-                            4: (Image.FLIP_TOP_BOTTOM,),
-                            5: (Image.FLIP_LEFT_RIGHT, Image.ROTATE_90),
-                            6: (Image.ROTATE_270,),
-                            7: (Image.FLIP_LEFT_RIGHT, Image.ROTATE_270),
-                            8: (Image.ROTATE_90,)
-                        }
-                        if orientation in ORIENTATION_TRANSFORMS:
-                            for transform in ORIENTATION_TRANSFORMS[orientation]:
-                                img = img.transpose(transform)
-            except Exception:
-                pass  # If EXIF handling fails, continue with original image
+            if (not manual and self.animation and not self.animation.loop_done
+                    and time.monotonic() - self.animation.due < READ_TIMEOUT):
+                # An animated slide stays up for at least one whole loop, unless its frames stopped coming
+                self.deadline = None
+                self.after_id = self.root.after(FRAME_POLL_MS, self.update_image, manual)
+                return
+            if manual and self.nav_future and not self.nav_future.done():
+                # Coalesce navigation: finish the decode in progress before starting on the latest target
+                self.show_placeholder(self.current_index)
+                self.after_id = self.root.after(FRAME_POLL_MS, self.update_image, manual)
+                return
             
-            img_w, img_h = img.size
-            
-            # Calculate scaling while preserving orientation
-            if img_w > img_h:  # Landscape
-                scale = min(self.screen_w / img_w, self.screen_h / img_h)
-            else:  # Portrait - maintain original size if possible
-                scale = min(self.screen_h / img_h, self.screen_w / img_w)
-            
-            new_w = int(img_w * scale)
-            new_h = int(img_h * scale)
+            # Hand over the frame decoded in the background, or wait for it without blocking Tk
+            self.current_index = self.image_files.seek(self.current_index)
+            if not manual:
+                self.current_index = self.skip_slow(self.current_index)
+            self.prefetch(self.current_index, keep_first=manual)
+            path = self.image_files[self.current_index]
+            future = self.prefetched[path]
+            refine = None
+            if manual and not future.done():
+                self.nav_future = future
+                self.show_placeholder(self.current_index)
+                self.after_id = self.root.after(FRAME_POLL_MS, self.update_image, manual)
+                return
+            if not future.done():
+                # A slide that is due gets a quick preview if there is one, keeping the full decode to swap in later
+                img = self.preview_frame(path)
+                if img is None:
+                    self.after_id = self.root.after(FRAME_POLL_MS, self.update_image, manual)
+                    return
+                refine = self.prefetched.pop(path)
+            else:
+                del self.prefetched[path]
+                img = future.result()
+                self.failures = 0
+                self.peak_decode_bytes = max(self.peak_decode_bytes, img.info.get("peak_bytes", 0))
+            if self.time_to_first_image is None:
+                self.time_to_first_image = time.perf_counter() - self.start_time
+                print(f"Time to first image: {self.time_to_first_image * 1000:.0f} ms")
+            if self.stats:
+                shown_at = time.perf_counter()
+            # Bring the letterboxed frame to the front and paste it into the photo on screen
+            if not (self.prepared and self.prepared[0] == path and self.prepared[1] is img):
+                self.compose(1 - self.front, img)
+            self.prepared = None
+            self.front = 1 - self.front
+            self.photo.paste(self.screen_buffers[self.front])
+            self.slide_token += 1
+            self.nav_pending = False
+            self.nav_future = None
+            self.placeholder = None
+            self.start_animation(path)
+            if self.stats:
+                converted_at = time.perf_counter()
+                self.stats.record("photoimage", converted_at - shown_at)
             
-            # Resize and convert to PhotoImage
-            img = img.resize((new_w, new_h), Image.LANCZOS)
-            self.current_image = ImageTk.PhotoImage(img)
+            # Update file info text with relative subfolder path
+            self.canvas.itemconfig(self.info_text, text=self.image_files.caption(self.current_index))
+            if self.stats:
+                self.root.update_idletasks()  # Let Tk redraw now, so it can be timed
+                drawn_at = time.perf_counter()
+                self.stats.record("draw", drawn_at - converted_at)
+                self.stats.record("update_image", drawn_at - started_at)
+                if self.stats_overlay:
+                    self.canvas.itemconfig(self.stats_overlay, text=self.stats.overlay_text())
             
-            # Display image centered
-            self.canvas.delete("all")
-            self.canvas.create_image(
-                self.screen_w // 2, 
-                self.screen_h // 2, 
-                image=self.current_image, 
-                anchor="center"
-            )
-              # Update file info text with relative subfolder path
-            abs_path = self.image_files[self.current_index]
-            # For multiple folders, try to find the best relative path
-            if isinstance(self.folder_path, list):
-                # Find which folder this file belongs to
-                best_rel_path = abs_path
-                for folder in self.folder_path:
-                    try:
-                        rel_path = os.path.relpath(abs_path, folder)
-                        if not rel_path.startswith('..'):
-                            best_rel_path = f"{os.path.basename(folder)} / {rel_path}"
-                            break
-                    except ValueError:
-                        continue
-                info = best_rel_path.replace("\\", " / ")
-            else:
-                rel_path = os.path.relpath(abs_path, self.folder_path)
-                info = rel_path.replace("\\", " / ")  # For nicer display on Windows
+            # Report how late the slide is compared to its deadline
+            due = None if manual else self.deadline
+            self.slides_shown += 1
+            if due is not None:
+                lateness = time.monotonic() - due
+                if lateness * 1000 > DEADLINE_TOLERANCE_MS:
+                    self.missed_deadlines += 1
+                if self.stats:
+                    self.stats.record("lateness", max(0, lateness))
             
-            # Delete old text and create new
-            if self.info_text:
-                self.canvas.delete(self.info_text)
-            self.info_text = self.canvas.create_text(
-                10, self.screen_h - 10,  # Position in bottom-left corner
-                text=info,
-                fill="white",
-                anchor="sw",  # Southwest alignment
-                font=("Arial", 12)
-            )
+            # Update index for next image and start decoding the upcoming ones
+            shown_index = self.current_index
+            self.current_index = self.image_files.advance(self.current_index)
+            # A new round starts with the slide on screen at position 0
+            self.displayed = (shown_index if self.current_index > shown_index else 0, path)
+            self.prefetch(self.current_index)
             
-            # Update index for next image
-            self.current_index = (self.current_index + 1) % len(self.image_files)            # Schedule next update only if not manual navigation
+            # Keep the cadence, or resume it a while after manual navigation
             if not manual:
-                self.after_id = self.root.after(1500, self.update_image)
+                self.schedule_slide(previous_deadline=due)
             else:
-                self.after_id = self.root.after(2500, self.update_image)  # Resume slideshow after 5s
+                self.schedule_slide(RESUME_DELAY_MS)
+            if refine:
+                self.root.after(FRAME_POLL_MS, self.refine_slide, self.slide_token, refine, time.perf_counter())
         except Exception as e:
             print(f"Error loading image: {e}")
-            self.current_index = (self.current_index + 1) % len(self.image_files)
+            if isinstance(e, TimeoutError):
+                # The file's root is hanging: pass over its images for a while and move on at once
+                self.read_timeouts += 1
+                self.slow_roots[self.image_files.root_of(self.current_index)] = (
+                    time.monotonic() + SLOW_ROOT_PENALTY)
+                self.current_index = self.image_files.advance(self.current_index)
+                self.schedule_slide(0 if not manual else MANUAL_ERROR_DELAY_MS)
+                return
+            if self.image_files[self.current_index] in self.quarantine:
+                self.image_files.discard_at(self.current_index)
+            if not self.image_files:
+                self.remove_image_files(())
+                return
+            self.current_index = self.image_files.advance(self.current_index)
+            # Back off exponentially while image after image fails
+            self.failures += 1
             if not manual:
-                self.after_id = self.root.after(100, self.update_image)
+                self.schedule_slide(min(100 * 2 ** (self.failures - 1), ERROR_BACKOFF_MAX_MS))
             else:
-                self.after_id = self.root.after(5000, self.update_image)
+                self.schedule_slide(MANUAL_ERROR_DELAY_MS)
                 
     def toggle_slideshow(self, event=None):
         """Toggle slideshow pause/resume with spacebar"""
+        if not self.image_files:
+            return
         if self.slideshow_paused:
             # Resume slideshow
             self.slideshow_paused = False
-            self.after_id = self.root.after(1500, self.update_image)
+            self.schedule_slide(SLIDE_INTERVAL_MS)
         else:
             # Pause slideshow
             self.slideshow_paused = True
-            if self.after_id:
-                self.root.after_cancel(self.after_id)
-                self.after_id = None
+            self.cancel_slide()
                 
     def delete_current_image(self, event=None):
+        """Hide the image on screen at once and queue its file for removal after the undo window"""
         if not self.image_files:
             return
-        
-        # Pause the slideshow while showing confirmation dialog
-        if self.after_id:
-            self.root.after_cancel(self.after_id)
+        if self.nav_pending:
+            # The screen shows a placeholder for the navigation target, not a slide that can be deleted yet
+            self.show_notice("Wait for the image to load before deleting it")
+            return
         
         # Get the currently displayed image (the one we just showed)
-        displayed_index = (self.current_index - 1) % len(self.image_files)
+        displayed_index = self.displayed_index()
+        if displayed_index is None or not self.image_files.is_alive(displayed_index):
+            return
         img_path = self.image_files[displayed_index]
         
-        # For multiple folders, find which folder this image belongs to
-        if isinstance(self.folder_path, list):
-            base_folder = None
-            for folder in self.folder_path:
-                try:
-                    rel_path = os.path.relpath(img_path, folder)
-                    if not rel_path.startswith('..'):
-                        base_folder = folder
-                        break
-                except ValueError:
-                    continue
-            if base_folder:
-                rel_path = os.path.relpath(img_path, base_folder)
-            else:
-                rel_path = img_path
-        else:
-            rel_path = os.path.relpath(img_path, self.folder_path)
-            
-        confirm = messagebox.askyesno(
-            "Delete Image",
-            f"Do you really want to delete this image?\n{rel_path}"
-        )
+        rel_path = self.image_files.relative_path(displayed_index)
+        if ARCHIVES.locate(img_path):
+            self.show_notice(f"Images inside archives cannot be deleted: {rel_path}")
+            return
         
-        if confirm:
+        root = self.image_files.root_of(displayed_index)
+        self.deleter.add(img_path)
+        self.deleted.append((img_path, self.image_files.roots[root] if root >= 0 else None))
+        self.image_files.discard_at(displayed_index)
+        future = self.prefetched.pop(img_path, None)
+        if future:
+            future.cancel()
+            self.read_ahead.drop(img_path)
+        self.frame_cache.invalidate(img_path)
+        if not self.after_delete_poll:
+            self.poll_deletions()
+        self.show_notice(f"Deleted {rel_path} - Ctrl+Z to undo")
+        if not self.image_files:
+            # That was the last image: show the empty screen while it can still be undone
+            self.remove_image_files(())
+            self.root.after(DELETE_UNDO_MS, self.close_if_empty)
+            return
+        # Positions stay put; update_image skips the deleted one
+        self.cancel_slide()
+        self.update_image(manual=True)
+    
+    def undo_delete(self, event=None):
+        """Take back the latest deletion whose file has not been removed yet, and show the image again (Ctrl+Z)"""
+        while self.deleted:
+            path, root = self.deleted.pop()
+            if self.deleter.undo(path):
+                break
+        else:
+            self.show_notice("Nothing to undo")
+            return
+        # Back in as the next slide, on a fresh position: the old one may be gone after a reshuffle
+        self.image_files.insert_at(path, self.current_index, root)
+        self.slideshow_started = True
+        self.show_notice(f"Restored {os.path.basename(path)}")
+        self.cancel_slide()
+        self.update_image(manual=True)
+    
+    def close_if_empty(self):
+        """Close once the last image was deleted and its undo window has passed"""
+        if self.image_files:
+            if not self.slideshow_started:
+                # Undone, or put back after the removal failed
+                self.slideshow_started = True
+                self.update_image()
+            return
+        if self.deleter.busy():
+            # Still being removed, or put back because that failed
+            self.root.after(DELETE_POLL_MS, self.close_if_empty)
+            return
+        self.close()
+    
+    def poll_deletions(self):
+        """Put back images whose file could not be removed and say why, while deletions are pending"""
+        self.after_delete_poll = None
+        while True:
             try:
-                os.remove(img_path)
-                del self.image_files[displayed_index]
-                if not self.image_files:
-                    self.root.destroy()
-                    return
-                # Adjust current_index since we removed an image
-                if displayed_index < self.current_index:
-                    self.current_index -= 1
-                self.current_index %= len(self.image_files)
-                self.update_image(manual=True)
-            except Exception as e:
-                messagebox.showerror("Error", f"Could not delete image:\n{e}")
-                # Resume slideshow after error
-                self.after_id = self.root.after(2500, self.update_image)
-        else:            # Resume slideshow if user cancelled deletion
-            self.after_id = self.root.after(2500, self.update_image)
+                path, error = self.deleter.failed.get_nowait()
+            except queue.Empty:
+                break
+            print(f"Error deleting image: {error}")
+            self.add_image_files([path], self.image_files.folder_root(os.path.dirname(path)))
+            self.show_notice(f"Could not delete {os.path.basename(path)}: {error.strerror or error}")
+        if self.deleter.busy():
+            self.after_delete_poll = self.root.after(DELETE_POLL_MS, self.poll_deletions)
+    
+    def show_notice(self, text):
+        """Show a short message above the caption for DELETE_UNDO_MS"""
+        self.canvas.itemconfig(self.notice_text, text=text)
+        if self.notice_after:
+            self.root.after_cancel(self.notice_after)
+        self.notice_after = self.root.after(DELETE_UNDO_MS, self.clear_notice)
+    
+    def clear_notice(self):
+        self.notice_after = None
+        self.canvas.itemconfig(self.notice_text, text="")
 
 def save_config(folders):
     """Save configuration to a file"""
-    config_path = os.path.join(os.path.expanduser("~"), "ImageViewerScreensaver.config")
+    config_path = app_file(".config")
     try:
         with open(config_path, 'w') as f:
             for folder in folders:
@@ -274,12 +2964,13 @@ def save_config(folders):
 
 def load_config():
     """Load configuration from file"""
-    config_path = os.path.join(os.path.expanduser("~"), "ImageViewerScreensaver.config")
+    config_path = app_file(".config")
     folders = []
     try:
         if os.path.exists(config_path):
             with open(config_path, 'r') as f:
-                folders = [line.strip() for line in f if line.strip() and os.path.isdir(line.strip())]
+                folders = [line.strip() for line in f
+                           if line.strip() and (os.path.isdir(line.strip()) or is_archive(line.strip()))]
     except Exception as e:
         print(f"Error loading config: {e}")
     return folders
@@ -288,7 +2979,7 @@ def show_config_dialog():
     """Show configuration dialog for screensaver"""
     root = Tk()
     root.title("Image Screensaver Configuration")
-    root.geometry("600x450")
+    root.geometry("760x450")
     root.resizable(True, True)
     
     # Load existing config
@@ -299,7 +2990,7 @@ def show_config_dialog():
     
     # Modern Windows styling
     Label(frame, text="Image Folders:", font=('Segoe UI', 12, 'bold')).pack(anchor='w', pady=(0, 5))
-    Label(frame, text="Select folders containing images for the screensaver slideshow:", 
+    Label(frame, text="Select folders or ZIP/TAR archives containing images for the screensaver slideshow:", 
           font=('Segoe UI', 9), fg='gray40').pack(anchor='w', pady=(0, 10))
     
     # Folder list
@@ -319,6 +3010,13 @@ def show_config_dialog():
         if folder and os.path.isdir(folder):
             folder_listbox.insert('end', folder)
     
+    def add_archive():
+        archive = filedialog.askopenfilename(title="Select Image Archive",
+                                             initialdir=os.path.expanduser("~/Pictures"),
+                                             filetypes=[("ZIP or TAR archives", "*.zip *.tar")])
+        if archive and is_archive(archive):
+            folder_listbox.insert('end', archive)
+    
     def remove_folder():
         selection = folder_listbox.curselection()
         if selection:
@@ -331,8 +3029,12 @@ def show_config_dialog():
     
     Button(button_frame, text="Add Folder", command=add_folder, 
            font=('Segoe UI', 10), width=12).pack(side='left', padx=(0, 5))
+    Button(button_frame, text="Add Archive", command=add_archive, 
+           font=('Segoe UI', 10), width=12).pack(side='left', padx=5)
     Button(button_frame, text="Remove", command=remove_folder, 
            font=('Segoe UI', 10), width=12).pack(side='left', padx=5)
+    Button(button_frame, text="Quarantine...", command=lambda: show_quarantine_dialog(root), 
+           font=('Segoe UI', 10), width=12).pack(side='left', padx=5)
     Button(button_frame, text="Cancel", command=root.destroy, 
            font=('Segoe UI', 10), width=12).pack(side='right', padx=(5, 0))
     Button(button_frame, text="OK", command=save_and_close, 
@@ -340,6 +3042,176 @@ def show_config_dialog():
     
     root.mainloop()
 
+def show_quarantine_dialog(parent):
+    """List the images that failed to load and let the user clear them"""
+    quarantine = Quarantine()
+    window = Toplevel(parent)
+    window.title("Quarantined Images")
+    window.geometry("700x400")
+    window.transient(parent)
+    
+    frame = Frame(window)
+    frame.pack(fill='both', expand=True, padx=20, pady=20)
+    
+    Label(frame, text="Images skipped because they could not be loaded:", 
+          font=('Segoe UI', 9), fg='gray40').pack(anchor='w', pady=(0, 10))
+    
+    listbox = Listbox(frame, height=12, font=('Segoe UI', 9), selectmode='extended')
+    listbox.pack(fill='both', expand=True, pady=(0, 10))
+    
+    paths = []
+    def refresh():
+        paths[:] = sorted(quarantine.records)
+        listbox.delete(0, 'end')
+        for path in paths:
+            record = quarantine.records[path]
+            listbox.insert('end', f"{path}  ({record['error']}, {record['attempts']} attempt(s))")
+    refresh()
+    
+    def clear_selected():
+        quarantine.remove([paths[i] for i in listbox.curselection()])
+        refresh()
+    
+    def clear_all():
+        quarantine.clear()
+        refresh()
+    
+    button_frame = Frame(frame)
+    button_frame.pack(fill='x', pady=10)
+    Button(button_frame, text="Clear Selected", command=clear_selected, 
+           font=('Segoe UI', 10), width=12).pack(side='left', padx=(0, 5))
+    Button(button_frame, text="Clear All", command=clear_all, 
+           font=('Segoe UI', 10), width=12).pack(side='left', padx=5)
+    Button(button_frame, text="Close", command=window.destroy, 
+           font=('Segoe UI', 10), width=12).pack(side='right', padx=(5, 0))
+
+def export_image(source, out_base, width, height, orientation):
+    """Export worker: write the aspect-fit render of an image to out_base plus .jpg, or .png if it has transparency
+    
+    Returns the path written. A render of the other type left by an earlier
+    export of the same source is removed.
+    """
+    img = load_scaled_image(source, width, height, orientation)
+    jpeg = img.mode in ("RGB", "L", "CMYK")
+    out_path = out_base + (".jpg" if jpeg else ".png")
+    img.save(out_path + ".tmp", "JPEG" if jpeg else "PNG", quality=90)
+    os.replace(out_path + ".tmp", out_path)
+    try:
+        os.remove(out_base + (".png" if jpeg else ".jpg"))
+    except FileNotFoundError:
+        pass
+    return out_path
+
+def export_images(folders, output, width, height, workers=None, rebuild_index=False):
+    """Render every image in folders to output at width x height in worker processes
+    
+    The renders keep the folder structure and each file's name, with .jpg
+    appended (.png for transparent images), so photo.tif becomes
+    photo.tif.jpg; several folders each get a subfolder named after them. Renders newer than their source are kept,
+    so an interrupted export picks up where it stopped. Renders from before
+    the resolution last changed do not count. Returns the number of failed
+    images, or None if the export was interrupted.
+    """
+    workers = max(1, min(workers or os.cpu_count() or 1, 61))  # 61 is the limit on Windows
+    os.makedirs(output, exist_ok=True)
+    manifest_path = os.path.join(output, ".export.json")
+    # Renders older than "since" are from another resolution
+    since = time.time()
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get("size") == [width, height]:
+            since = manifest["since"]
+    except (OSError, ValueError, KeyError):
+        pass
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({"size": [width, height], "since": since, "folders": folders}, f)
+    
+    # Share the slideshow's file index when exporting the configured folders, and keep a separate one otherwise
+    index = FileIndex(None if folders == load_config() else app_file(".export.index"))
+    counts = {"rendered": 0, "skipped": 0, "failed": 0}
+    pending = {}  # future -> source path
+    start = last_report = time.perf_counter()
+    
+    def report(final=False):
+        elapsed = time.perf_counter() - start
+        print(f"{'Exported' if final else 'Exporting:'} {counts['rendered']} rendered, "
+              f"{counts['skipped']} up to date, {counts['failed']} failed in {elapsed:.1f}s "
+              f"({counts['rendered'] / elapsed if elapsed else 0:.1f} images/s)")
+    
+    def up_to_date(out_base, st):
+        for ext in (".jpg", ".png"):
+            try:
+                return os.stat(out_base + ext).st_mtime >= max(st.st_mtime, since)
+            except OSError:
+                pass
+        return False
+    
+    def collect():
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            path = pending.pop(future)
+            try:
+                future.result()
+                counts["rendered"] += 1
+            except Exception as e:
+                counts["failed"] += 1
+                print(f"Error exporting {path}: {e}")
+    
+    interrupted = False
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        for root, paths in index.iter_scan(folders, rebuild=rebuild_index):
+            for path in paths:
+                rel_path = os.path.relpath(path, root)
+                if len(folders) > 1:
+                    rel_path = os.path.join(os.path.basename(root.rstrip(os.sep)), rel_path)
+                # The source's extension stays in the name, so scan.jpg and scan.tif do not collide
+                out_base = os.path.join(output, rel_path)
+                try:
+                    st = stat_image(path)
+                except OSError as e:
+                    counts["failed"] += 1
+                    print(f"Error exporting {path}: {e}")
+                    continue
+                if up_to_date(out_base, st):
+                    counts["skipped"] += 1
+                    continue
+                os.makedirs(os.path.dirname(out_base), exist_ok=True)
+                meta = index.metadata(path, st)
+                orientation = meta[3] if meta and len(meta) == 5 else None
+                # Archive members are passed by location, since workers have not indexed the archives
+                source = ARCHIVES.locate(path) or path
+                pending[pool.submit(export_image, source, out_base, width, height, orientation)] = path
+                if len(pending) >= workers * EXPORT_QUEUE_PER_WORKER:
+                    collect()
+                if time.perf_counter() - last_report > EXPORT_PROGRESS_INTERVAL:
+                    last_report = time.perf_counter()
+                    report()
+        while pending:
+            collect()
+    except KeyboardInterrupt:
+        interrupted = True
+        print("Export interrupted; run it again to continue")
+    finally:
+        # Renders already running are finished, so none is left half-written
+        pool.shutdown(cancel_futures=True)
+        ARCHIVES.close()
+    report(final=True)
+    return None if interrupted else counts["failed"]
+
+def parse_export_args(args):
+    """(output, width, height, folders, workers) from the arguments after /e"""
+    workers = None
+    if '--workers' in args:
+        i = args.index('--workers')
+        workers = int(args[i + 1])
+        del args[i:i + 2]
+    if len(args) < 2:
+        raise ValueError("usage: /e OUTPUT_FOLDER WIDTHxHEIGHT [FOLDER ...] [--workers N]")
+    width, height = (int(n) for n in args[1].lower().split('x'))
+    return args[0], width, height, args[2:], workers
+
 def show_preview(hwnd=None):
     """Show preview in screensaver settings (simplified)"""
     # Don't show any preview window - just exit silently
@@ -347,6 +3219,18 @@ def show_preview(hwnd=None):
     pass
 
 if __name__ == "__main__":
+    # Lets decode worker processes start from a frozen executable
+    freeze_support()
+    
+    # Forget the saved file index and list every folder again
+    rebuild_index = '--rebuild-index' in sys.argv
+    if rebuild_index:
+        sys.argv.remove('--rebuild-index')
+    # Record slide timings to the stats file (F3 shows them on screen)
+    collect_stats = '--stats' in sys.argv or STATS_ENABLED
+    if '--stats' in sys.argv:
+        sys.argv.remove('--stats')
+    
     # Handle Windows screensaver command line arguments
     if len(sys.argv) > 1:
         arg = sys.argv[1].lower()
@@ -367,11 +3251,26 @@ if __name__ == "__main__":
             show_preview(hwnd)
             sys.exit(0)
             
+        elif arg.startswith('/e') or arg.startswith('-e'):
+            # Export mode: render the configured or given folders to a folder, without a window
+            try:
+                output, width, height, folders, workers = parse_export_args(sys.argv[2:])
+            except (ValueError, IndexError) as e:
+                print(f"Error in export arguments: {e}")
+                sys.exit(2)
+            folders = folders or load_config()
+            if not folders:
+                print("No folders given or configured.")
+                sys.exit(2)
+            failed = export_images(folders, output, width, height, workers, rebuild_index=rebuild_index)
+            sys.exit(130 if failed is None else 1 if failed else 0)
+            
         elif arg.startswith('/s') or arg.startswith('-s'):
             # Screensaver mode
             folders = load_config()
             if folders:
-                ImageViewer(folders, screensaver_mode=True)
+                ImageViewer(folders, screensaver_mode=True, rebuild_index=rebuild_index,
+                            collect_stats=collect_stats)
             else:
                 # No configuration found, show config dialog
                 show_config_dialog()
@@ -409,6 +3308,6 @@ if __name__ == "__main__":
     root.destroy()
     
     if folders:
-        ImageViewer(folders)
+        ImageViewer(folders, rebuild_index=rebuild_index, collect_stats=collect_stats)
     else:
         print("No folders selected.")